@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+fakes.install()
+
+# -----------------------
+# Receiver on fake devices
+# -----------------------
+# Runs linux.py or windows.py on localhost with FakeUInput / a stubbed
+# vgamepad, no UI and no config.json watcher, for the load generator:
+#
+#   python bench/fake_server.py linux --port 5000 [--server-mode selectors] [--udp]
+#   python bench/fake_server.py windows --port 5000 [--udp]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receiver backed by fake devices")
+    parser.add_argument("backend", choices=("linux", "windows"))
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--server-mode", choices=("threads", "selectors"), default="threads",
+                        help="linux only: thread per client or one event loop")
+    parser.add_argument("--udp", action="store_true", help="let decks send input over UDP")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    if args.backend == "linux":
+        import linux as receiver
+        receiver.SHOW_UI = False
+        receiver.PC_IP = "127.0.0.1"
+        receiver.server.config["SERVER_MODE"] = args.server_mode
+    else:
+        import windows as receiver
+    receiver.server.port = args.port
+    receiver.server.config["USE_UDP"] = args.udp
+    receiver.ringlog.set_level(args.log_level)
+
+    if args.backend == "linux" and args.server_mode == "selectors":
+        threading.Thread(target=receiver.selector_server, daemon=True).start()
+    else:
+        threading.Thread(target=receiver.controller_server, daemon=True).start()
+        if args.udp:
+            threading.Thread(target=receiver.udp_server, daemon=True).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
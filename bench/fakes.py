@@ -0,0 +1,116 @@
+import sys
+import types
+
+# -----------------------
+# Device stand-ins
+# -----------------------
+# Lets linux.py and windows.py be imported and driven on a headless box:
+# no /dev/uinput, no ViGEm. install() must run before the receiver module
+# is imported. Real evdev key codes are used when evdev is installed.
+
+
+class FakeUInput:
+    # Counts what would have reached the kernel instead of keeping every
+    # write, so long runs don't measure list growth.
+    def __init__(self, *args, **kwargs):
+        self.writes = 0
+        self.syns = 0
+        self.last = None
+
+    def write(self, etype, code, value):
+        self.writes += 1
+        self.last = (etype, code, value)
+
+    def syn(self):
+        self.syns += 1
+
+    def close(self):
+        pass
+
+
+def _fake_ecodes():
+    names = (
+        "EV_SYN EV_KEY EV_ABS EV_FF FF_RUMBLE BUS_USB "
+        "BTN_A BTN_B BTN_X BTN_Y BTN_TL BTN_TR BTN_SELECT BTN_START BTN_THUMBL BTN_THUMBR "
+        "BTN_DPAD_UP BTN_DPAD_DOWN BTN_DPAD_LEFT BTN_DPAD_RIGHT "
+        "ABS_X ABS_Y ABS_RX ABS_RY ABS_Z ABS_RZ ABS_HAT0X ABS_HAT0Y ABS_WHEEL ABS_TILT_X ABS_TILT_Y"
+    ).split()
+    ecodes = types.SimpleNamespace()
+    for i, name in enumerate(names):
+        setattr(ecodes, name, i)
+    return ecodes
+
+
+def install_evdev():
+    try:
+        from evdev import ecodes
+    except ImportError:
+        ecodes = _fake_ecodes()
+    module = types.ModuleType("evdev")
+    module.UInput = FakeUInput
+    module.ecodes = ecodes
+    sys.modules["evdev"] = module
+
+
+class _XusbButton:
+    XUSB_GAMEPAD_DPAD_UP = 0x0001
+    XUSB_GAMEPAD_DPAD_DOWN = 0x0002
+    XUSB_GAMEPAD_DPAD_LEFT = 0x0004
+    XUSB_GAMEPAD_DPAD_RIGHT = 0x0008
+    XUSB_GAMEPAD_START = 0x0010
+    XUSB_GAMEPAD_BACK = 0x0020
+    XUSB_GAMEPAD_LEFT_THUMB = 0x0040
+    XUSB_GAMEPAD_RIGHT_THUMB = 0x0080
+    XUSB_GAMEPAD_LEFT_SHOULDER = 0x0100
+    XUSB_GAMEPAD_RIGHT_SHOULDER = 0x0200
+    XUSB_GAMEPAD_GUIDE = 0x0400
+    XUSB_GAMEPAD_A = 0x1000
+    XUSB_GAMEPAD_B = 0x2000
+    XUSB_GAMEPAD_X = 0x4000
+    XUSB_GAMEPAD_Y = 0x8000
+
+
+class FakeVX360Gamepad:
+    def __init__(self):
+        self.report = types.SimpleNamespace(wButtons=0, bLeftTrigger=0, bRightTrigger=0,
+                                            sThumbLX=0, sThumbLY=0, sThumbRX=0, sThumbRY=0)
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+
+
+def install_vgamepad():
+    module = types.ModuleType("vgamepad")
+    module.XUSB_BUTTON = _XusbButton
+    module.VX360Gamepad = FakeVX360Gamepad
+    sys.modules["vgamepad"] = module
+
+
+def install():
+    install_evdev()
+    install_vgamepad()
+
+
+class FakeConn:
+    # Plays a pre-encoded byte stream into FrameReader.recv_from() in
+    # fixed-size chunks, like a socket that always has data ready.
+    def __init__(self, data, chunk=4096):
+        self.data = memoryview(data)
+        self.chunk = chunk
+        self.pos = 0
+
+    def rewind(self):
+        self.pos = 0
+
+    def recv_into(self, buf, size=0):
+        n = min(size or len(buf), self.chunk, len(self.data) - self.pos)
+        buf[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,269 @@
+import argparse
+import os
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol
+import metrics
+from traffic import KINDS, SEED, make_workload
+
+# -----------------------
+# Multi-client load generator
+# -----------------------
+# Opens N synthetic decks against a receiver, each replaying deck-like
+# traffic at a fixed rate, and reports per step of N:
+#   fps         frames sent per second, all decks together (target in brackets)
+#   reply ms    p50/p95/p99 reply latency: the per-frame reply in acked mode,
+#               the pong to a ping every PING_INTERVAL when pipelined or UDP
+#   cpu %       receiver process CPU (only with --spawn, from /proc)
+#   dropped     decks whose connection failed or was closed on them
+#
+#   python bench/loadgen.py --spawn linux --clients 1,4,16,64 --rate 125
+#   python bench/loadgen.py --target 127.0.0.1:5000 --clients 8 --pipelined --udp
+#
+# --spawn starts bench/fake_server.py (the receiver on fake devices) on a
+# free localhost port and stops it afterwards.
+PING_INTERVAL = 0.1
+CONNECT_TIMEOUT = 2.0
+REPLY_TIMEOUT = 2.0
+
+
+class SyntheticDeck:
+    def __init__(self, index, target, args):
+        self.index = index
+        self.target = target
+        self.codec = args.codec
+        self.pipelined = args.pipelined
+        self.udp = args.udp
+        self.rate = args.rate
+        # Receivers ignore motion input unless the hello offers gyro.
+        self.gyro = args.kind == "gyro"
+        self.frames = make_workload(args.kind, max(1, int(args.rate * args.duration)), seed=SEED + index)
+        self.sent = 0
+        self.late = 0
+        self.replies = metrics.Histogram()
+        self.error = None
+        self.sock = None
+        self.reader = protocol.FrameReader()
+        self.udp_sock = None
+        self.udp_addr = None
+        self.session = 0
+
+    def connect(self):
+        sock = socket.create_connection(self.target, timeout=CONNECT_TIMEOUT)
+        sock.settimeout(REPLY_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        transports = [protocol.TRANSPORT_UDP, protocol.TRANSPORT_TCP] if self.udp else [protocol.TRANSPORT_TCP]
+        sock.sendall(protocol.encode(protocol.make_hello([self.codec], transports=transports, ack=not self.pipelined,
+                                                        gyro=self.gyro)))
+        welcome = self.read_reply()
+        while welcome.get("type") in protocol.PUSHED_TYPES:
+            welcome = self.read_reply()
+        if welcome.get("type") != "welcome":
+            raise ConnectionError("receiver did not answer the hello")
+        data = welcome["data"]
+        self.codec = data.get("codec", protocol.CODEC_JSON)
+        self.pipelined = data.get("ack") is False
+        if data.get("transport") == protocol.TRANSPORT_UDP:
+            self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_addr = (self.target[0], data.get("udp_port", self.target[1]))
+            self.session = data["session"]
+
+    def read_reply(self):
+        while True:
+            line = self.reader.next_frame()
+            if line:
+                return protocol.decode(line)
+            if line is None and self.reader.recv_from(self.sock) == 0:
+                raise ConnectionError("receiver closed the connection")
+
+    def drain(self, timeout=0):
+        # Pipelined replies are read as they arrive, also while waiting for
+        # the next frame, so pong latency isn't rounded up to the frame rate.
+        while select.select([self.sock], [], [], timeout)[0]:
+            timeout = 0
+            if self.reader.recv_from(self.sock) == 0:
+                raise ConnectionError("receiver closed the connection")
+            while True:
+                line = self.reader.next_frame()
+                if line is None:
+                    break
+                if line:
+                    self.on_reply(protocol.decode(line))
+
+    def on_reply(self, reply):
+        if reply.get("type") == "pong":
+            self.replies.record((time.monotonic() - reply["data"]["t"]) * 1000.0)
+
+    def ping(self):
+        self.sock.sendall(protocol.encode({"type": "ping", "data": {"t": time.monotonic()}}, self.codec))
+        if not self.pipelined:
+            self.on_reply(self.read_reply())
+
+    def send(self, frame):
+        self.sent += 1
+        if self.udp_sock is not None:
+            self.udp_sock.sendto(protocol.encode_datagram(self.session, self.sent, frame, self.codec), self.udp_addr)
+            return
+        t = time.monotonic()
+        self.sock.sendall(protocol.encode(frame, self.codec))
+        if not self.pipelined:
+            self.read_reply()
+            self.replies.record((time.monotonic() - t) * 1000.0)
+
+    def run(self, start, stop):
+        try:
+            self.connect()
+            while time.monotonic() < start:
+                time.sleep(0.001)
+            period = 1.0 / self.rate
+            due = time.monotonic()
+            next_ping = due
+            probing = self.pipelined or self.udp_sock is not None
+            i = 0
+            while True:
+                now = time.monotonic()
+                if now >= stop:
+                    break
+                if now < due:
+                    if self.pipelined:
+                        while now < due:
+                            self.drain(due - now)
+                            now = time.monotonic()
+                    else:
+                        time.sleep(due - now)
+                elif now - due > period:
+                    # Fell a whole frame behind: count it, don't burst to catch up.
+                    self.late += 1
+                    due = now
+                due += period
+                self.send(self.frames[i % len(self.frames)])
+                i += 1
+                if probing:
+                    if now >= next_ping:
+                        next_ping = now + PING_INTERVAL
+                        self.ping()
+                    if self.pipelined:
+                        self.drain()
+        except Exception as ex:
+            self.error = str(ex) or type(ex).__name__
+        finally:
+            for s in (self.sock, self.udp_sock):
+                if s is not None:
+                    try:
+                        s.close()
+                    except OSError:
+                        pass
+
+
+def cpu_seconds(pid):
+    # utime + stime of a process, from /proc (Linux only)
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_server(args):
+    port = free_port()
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_server.py"),
+           args.spawn, "--port", str(port), "--server-mode", args.server_mode]
+    if args.udp:
+        cmd.append("--udp")
+    proc = subprocess.Popen(cmd)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc, ("127.0.0.1", port)
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+    proc.kill()
+    raise SystemExit("❌ fake server did not come up")
+
+
+def run_step(n, target, args, pid):
+    decks = [SyntheticDeck(i, target, args) for i in range(n)]
+    start = time.monotonic() + 0.5 + n * 0.005
+    stop = start + args.duration
+    threads = [threading.Thread(target=d.run, args=(start, stop), daemon=True) for d in decks]
+    for t in threads:
+        t.start()
+    while time.monotonic() < start:
+        time.sleep(0.01)
+    cpu0 = cpu_seconds(pid) if pid else None
+    for t in threads:
+        t.join(args.duration + REPLY_TIMEOUT + 5)
+    cpu1 = cpu_seconds(pid) if pid else None
+
+    replies = metrics.Histogram()
+    for d in decks:
+        replies.merge(d.replies)
+    sent = sum(d.sent for d in decks)
+    dropped = [d for d in decks if d.error]
+    cpu = "%.0f" % ((cpu1 - cpu0) / args.duration * 100.0) if cpu0 is not None and cpu1 is not None else "-"
+    print("%7d %10.0f [%6.0f] %22s %6s %8d %7d" % (
+        n, sent / args.duration, n * args.rate, replies.describe(), cpu, len(dropped), sum(d.late for d in decks)))
+    for d in dropped[:3]:
+        print("        deck #%d: %s" % (d.index, d.error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic-deck load generator")
+    parser.add_argument("--target", help="HOST:PORT of a running receiver")
+    parser.add_argument("--spawn", choices=("linux", "windows"), help="start a receiver on fake devices")
+    parser.add_argument("--server-mode", choices=("threads", "selectors"), default="threads")
+    parser.add_argument("--clients", default="1,2,4,8,16,32", help="comma-separated deck counts to step through")
+    parser.add_argument("--rate", type=float, default=125.0, help="frames per second per deck")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per step")
+    parser.add_argument("--kind", choices=KINDS, default="full_state")
+    parser.add_argument("--codec", choices=protocol.SUPPORTED_CODECS, default=protocol.CODEC_BINARY)
+    parser.add_argument("--pipelined", action="store_true", help="fire-and-forget frames instead of acked")
+    parser.add_argument("--udp", action="store_true", help="send input as UDP datagrams (needs --pipelined)")
+    args = parser.parse_args()
+    if args.udp and not args.pipelined:
+        parser.error("--udp needs --pipelined: receivers keep acked decks on TCP")
+
+    proc = None
+    pid = None
+    if args.spawn:
+        proc, target = spawn_server(args)
+        pid = proc.pid
+    elif args.target:
+        host, _, port = args.target.rpartition(":")
+        target = (host or "127.0.0.1", int(port))
+    else:
+        parser.error("give --target HOST:PORT or --spawn linux|windows")
+
+    mode = "pipelined" if args.pipelined else "acked"
+    print(f"📈 {args.kind} at {args.rate:.0f} Hz per deck, {args.codec} over {'udp' if args.udp else 'tcp'} ({mode}), "
+          f"{args.duration:.0f}s per step -> {target[0]}:{target[1]}")
+    print("%7s %10s %8s %22s %6s %8s %7s" % ("decks", "fps", "[target]", "reply ms p50/p95/p99", "cpu %", "dropped", "late"))
+    try:
+        for n in [int(c) for c in args.clients.split(",") if c.strip()]:
+            run_step(n, target, args, pid)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+fakes.install()
+
+from traffic import make_workload, count_values
+
+import protocol
+import linux
+import windows
+
+# -----------------------
+# Receiver microbenchmarks
+# -----------------------
+# Drives the receivers' decode-and-apply path at full speed against fake
+# devices and prints, per case:
+#   events/s    input values applied per second
+#   us/frame    wall time per frame
+#   blocks/fr   net pymalloc blocks left behind per frame (should be ~0)
+#   KiB peak    traced memory high-water mark during one pass, over the
+#               baseline, i.e. what a frame allocates transiently
+#
+#   python bench/receiver_bench.py [--frames N] [--only SUBSTRING]
+#
+# Cases: linux.handle_event (one call per value), linux.dispatch
+# (decoded frames), linux.read_client (framing + decode + apply, per codec)
+# and windows.dispatch. Workloads: delta (batches of 1-3 changes),
+# full_state (6 axes, 11 buttons, hat) and gyro (x/y/z triples), see
+# traffic.py.
+
+
+def measure(name, frames, values, run):
+    # One warm-up pass, one timed pass, one traced pass.
+    run()
+    gc.collect()
+    gc.disable()
+    blocks = sys.getallocatedblocks()
+    t0 = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - t0
+    blocks = sys.getallocatedblocks() - blocks
+    gc.enable()
+
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("%-36s %9d %12.0f %10.2f %10.3f %9.1f" % (
+        name, frames, values / elapsed, elapsed / frames * 1e6, blocks / frames, (peak - base) / 1024.0))
+
+
+# -----------------------
+# Cases
+# -----------------------
+def linux_handle_event(frames):
+    ui = linux.VirtualPad(fakes.FakeUInput())
+    st = linux.ControllerState()
+    calls = []
+    for f in frames:
+        if f["type"] == "batch":
+            calls.extend(f["data"]["events"])
+        elif f["type"] == "gyro":
+            calls.extend((f"GYRO_{n}", f["data"][n.lower()]) for n in protocol.GYRO_NAMES)
+        else:
+            d = f["data"]
+            calls.extend((f"AXIS_{i}", v) for i, v in enumerate(d["axes"]))
+            calls.extend((f"BTN_{i}", v) for i, v in enumerate(d["buttons"]))
+            calls.append(("HAT_0", d["hat"]))
+    handle_event = linux.handle_event
+
+    def run():
+        for code, value in calls:
+            handle_event(ui, 1, code, value, st)
+    return run
+
+
+def linux_dispatch(frames):
+    ui = linux.VirtualPad(fakes.FakeUInput())
+    st = linux.ControllerState()
+    dispatch = linux.dispatch_event
+
+    def run():
+        for f in frames:
+            dispatch(ui, 1, f, st)
+    return run
+
+
+def linux_read_client(frames, codec):
+    session = linux.ClientSession(1, None, ("bench", 0))
+    session.device = linux.VirtualPad(fakes.FakeUInput())
+    session.ack = False
+    # As negotiated by a deck with motion sensors, or gyro frames are ignored
+    session.gyro = True
+    session.reader.codec = codec
+    linux.client_states[1] = linux.ControllerState()
+    conn = fakes.FakeConn(b"".join(protocol.encode(f, codec) for f in frames))
+    session.conn = conn
+    read_client = linux.read_client
+
+    def run():
+        conn.rewind()
+        while read_client(session):
+            pass
+    return run
+
+
+def windows_dispatch(frames):
+    pad = windows.Pad(fakes.FakeVX360Gamepad())
+    dispatch = windows.dispatch_event
+
+    def run():
+        for f in frames:
+            dispatch(pad, f)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receiver decode-and-apply microbenchmarks")
+    parser.add_argument("--frames", type=int, default=20000, help="frames per workload")
+    parser.add_argument("--only", default="", help="run only cases whose name contains this")
+    args = parser.parse_args()
+
+    # Keep the per-frame log calls cheap and quiet, as in production.
+    linux.ringlog.set_level("WARNING")
+
+    print("%-36s %9s %12s %10s %10s %9s" % ("case", "frames", "events/s", "us/frame", "blocks/fr", "KiB peak"))
+    for kind in ("delta", "full_state", "gyro"):
+        frames = make_workload(kind, args.frames)
+        values = count_values(frames)
+        cases = [
+            (f"linux.handle_event {kind}", lambda: linux_handle_event(frames)),
+            (f"linux.dispatch {kind}", lambda: linux_dispatch(frames)),
+            (f"linux.read_client {kind} binary", lambda: linux_read_client(frames, protocol.CODEC_BINARY)),
+            (f"linux.read_client {kind} json", lambda: linux_read_client(frames, protocol.CODEC_JSON)),
+        ]
+        if kind != "gyro":
+            # The XUSB report has no motion axes.
+            cases.append((f"windows.dispatch {kind}", lambda: windows_dispatch(frames)))
+        for name, build in cases:
+            if args.only in name:
+                measure(name, len(frames), values, build())
+
+
+if __name__ == "__main__":
+    main()
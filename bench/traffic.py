@@ -0,0 +1,53 @@
+import random
+
+# -----------------------
+# Synthetic deck traffic
+# -----------------------
+# Deterministic input streams shaped like a Deck in play: sticks doing a
+# random walk, an occasional button toggle and hat flick. Shared by the
+# microbenchmarks and the load generator.
+SEED = 1234
+N_AXES = 6
+N_BUTTONS = 11
+KINDS = ("delta", "full_state", "gyro")
+
+
+def make_workload(kind, frames, seed=SEED):
+    rnd = random.Random(seed)
+    axes = [0.0] * N_AXES
+    buttons = [0] * N_BUTTONS
+    b = 0
+    out = []
+    for _ in range(frames):
+        i = rnd.randrange(N_AXES)
+        axes[i] = max(-1.0, min(1.0, round(axes[i] + rnd.uniform(-0.1, 0.1), 2)))
+        if rnd.random() < 0.1:
+            b = rnd.randrange(N_BUTTONS)
+            buttons[b] ^= 1
+        if kind == "delta":
+            events = [[f"AXIS_{i}", axes[i]]]
+            if rnd.random() < 0.3:
+                events.append([f"BTN_{b}", buttons[b]])
+            if rnd.random() < 0.1:
+                events.append(["HAT_0", [rnd.randint(-1, 1), rnd.randint(-1, 1)]])
+            out.append({"type": "batch", "data": {"events": events}})
+        elif kind == "full_state":
+            out.append({"type": "full_state", "data": {
+                "axes": list(axes), "buttons": list(buttons), "hat": [0, rnd.randint(-1, 1)]}})
+        else:
+            out.append({"type": "gyro", "data": {
+                "x": rnd.uniform(-1, 1), "y": rnd.uniform(-1, 1), "z": rnd.uniform(-1, 1)}})
+    return out
+
+
+def count_values(frames):
+    n = 0
+    for f in frames:
+        d = f["data"]
+        if f["type"] == "batch":
+            n += len(d["events"])
+        elif f["type"] == "full_state":
+            n += len(d["axes"]) + len(d["buttons"]) + 1
+        else:
+            n += 3
+    return n
@@ -0,0 +1,110 @@
+import mmap
+import os
+import struct
+import time
+
+import protocol
+
+# -----------------------
+# Input capture files
+# -----------------------
+# An append-only record of the frames a sender sent:
+#   file:   <magic "DCAP"> <version:u8>, then records until EOF
+#   record: <t:f64> <codec:u8> <len:u32> <frame>
+# t is seconds since the capture was opened (time.monotonic() based), and
+# <frame> is the frame exactly as the sender encoded it, in its TCP stream
+# framing: length-prefixed binary or a JSON line (frames sent as UDP
+# datagrams get the same framing). Appending to an existing capture
+# continues after its last record.
+MAGIC = b"DCAP"
+VERSION = 1
+FLUSH_INTERVAL = 1.0
+
+CODEC_IDS = {protocol.CODEC_JSON: 0, protocol.CODEC_BINARY: 1}
+CODEC_NAMES = {v: k for k, v in CODEC_IDS.items()}
+
+_FILE_HEADER = struct.Struct("<4sB")
+_RECORD = struct.Struct("<dBI")
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.f = open(path, "ab")
+        if self.f.tell() == 0:
+            self.f.write(_FILE_HEADER.pack(MAGIC, VERSION))
+            self.offset = 0.0
+        else:
+            self.offset = last_time(path)
+        self.start = time.monotonic()
+        self.last_flush = self.start
+        self.frames = 0
+
+    def write(self, frame, codec, now=None):
+        now = time.monotonic() if now is None else now
+        self.f.write(_RECORD.pack(self.offset + now - self.start, CODEC_IDS[codec], len(frame)))
+        self.f.write(frame)
+        self.frames += 1
+        if now - self.last_flush >= FLUSH_INTERVAL:
+            self.last_flush = now
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def _check_header(data):
+    if len(data) < _FILE_HEADER.size:
+        raise ValueError("not a capture file")
+    magic, version = _FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a capture file (or an unsupported version)")
+
+
+def read_records(path, use_mmap=True):
+    # Yields (t, codec, frame) in file order. With mmap the frames are
+    # memoryview slices of the mapping, so a capture of any size streams
+    # without being read into memory. A record cut short by a crash ends
+    # the capture.
+    with open(path, "rb") as f:
+        if not use_mmap or os.fstat(f.fileno()).st_size == 0:
+            yield from _read_stream(f)
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(m)
+        try:
+            _check_header(view)
+            offset = _FILE_HEADER.size
+            size = len(view)
+            while offset + _RECORD.size <= size:
+                t, codec, length = _RECORD.unpack_from(view, offset)
+                offset += _RECORD.size
+                if offset + length > size:
+                    break
+                yield t, CODEC_NAMES[codec], view[offset:offset + length]
+                offset += length
+        finally:
+            view.release()
+            try:
+                m.close()
+            except BufferError:
+                pass   # a caller still holds a frame; unmapped once it's gone
+
+
+def _read_stream(f):
+    _check_header(f.read(_FILE_HEADER.size))
+    while True:
+        head = f.read(_RECORD.size)
+        if len(head) < _RECORD.size:
+            return
+        t, codec, length = _RECORD.unpack(head)
+        frame = f.read(length)
+        if len(frame) < length:
+            return
+        yield t, CODEC_NAMES[codec], frame
+
+
+def last_time(path):
+    t = 0.0
+    for t, _, _ in read_records(path, use_mmap=False):
+        pass
+    return t
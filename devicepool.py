@@ -0,0 +1,79 @@
+import threading
+import time
+
+# -----------------------
+# Virtual device pool
+# -----------------------
+# Virtual pads are slow to create, and games notice when one disappears
+# (they drop the controller or renumber the players), so the receivers
+# keep them around across connections:
+#   - size idle devices are created up front, so a new deck gets one at once;
+#   - a deck that names itself (the "client" key of its hello) has its
+#     device parked under that key when it disconnects, and gets the same
+#     device back if it reconnects within grace seconds;
+#   - a device is reset to a released pad whenever it changes hands, so
+#     nothing stays held while its deck is away.
+# Parked devices whose grace ran out go back to the idle pool, or are
+# destroyed if the pool is full.
+class DevicePool:
+    def __init__(self, create, reset, destroy, size=1, grace=30.0):
+        self.create = create
+        self.reset = reset
+        self.destroy = destroy
+        self.size = size
+        self.grace = grace
+        self.idle = []
+        self.parked = {}
+        self.lock = threading.Lock()
+
+    def fill(self):
+        while True:
+            with self.lock:
+                if len(self.idle) >= self.size:
+                    return
+            device = self.create()
+            with self.lock:
+                self.idle.append(device)
+
+    def acquire(self, key=None):
+        # Returns (device, resumed): the device parked under key if there is
+        # one, else an idle one, else a new one.
+        with self.lock:
+            if key is not None and key in self.parked:
+                return self.parked.pop(key)[0], True
+            if self.idle:
+                return self.idle.pop(), False
+        return self.create(), False
+
+    def release(self, device, key=None):
+        try:
+            self.reset(device)
+        except Exception:
+            self.destroy(device)
+            raise
+        if key is None or self.grace <= 0:
+            self._recycle(device)
+            return
+        with self.lock:
+            previous = self.parked.pop(key, None)
+            self.parked[key] = (device, time.monotonic() + self.grace)
+        if previous is not None:
+            self._recycle(previous[0])
+
+    def expire(self, now=None):
+        # Hands parked devices whose grace ran out back to the pool and
+        # returns their keys.
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            expired = [key for key, (_, until) in self.parked.items() if until <= now]
+            devices = [self.parked.pop(key)[0] for key in expired]
+        for device in devices:
+            self._recycle(device)
+        return expired
+
+    def _recycle(self, device):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(device)
+                return
+        self.destroy(device)
@@ -0,0 +1,123 @@
+import json
+import random
+import socket
+import struct
+import time
+
+import protocol
+
+# -----------------------
+# LAN discovery
+# -----------------------
+# A sender looks for receivers with one UDP probe, sent to the broadcast
+# addresses it knows and to a multicast group, on DISCOVERY_PORT:
+#   {"type": "discover", "versions": [...], "nonce": n}
+# Every receiver that hears it answers the sender directly with
+#   {"type": "receiver", "nonce": n, "name": ..., "port": ..., ...}
+# naming its ports and what it supports. Both are single JSON datagrams;
+# anything else arriving on the port is ignored.
+DISCOVERY_PORT = 5002
+MULTICAST_GROUP = "239.255.68.67"
+DISCOVERY_TIMEOUT = 0.5
+MAX_DATAGRAM = 1024
+
+
+def make_probe(nonce):
+    return {"type": "discover", "versions": list(protocol.SUPPORTED_VERSIONS), "nonce": nonce}
+
+
+def make_announce(nonce, **info):
+    announce = {"type": "receiver", "nonce": nonce,
+                "versions": list(protocol.SUPPORTED_VERSIONS), "codecs": list(protocol.SUPPORTED_CODECS)}
+    announce.update(info)
+    return announce
+
+
+# -----------------------
+# Receiver side
+# -----------------------
+def open_responder(interface_ip="0.0.0.0"):
+    # Bound to every address: on Linux a socket bound to one unicast
+    # address never sees broadcasts. interface_ip only picks where to join
+    # the multicast group.
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", DISCOVERY_PORT))
+    for ip in (interface_ip, "0.0.0.0"):
+        try:
+            mreq = struct.pack("4s4s", socket.inet_aton(MULTICAST_GROUP), socket.inet_aton(ip))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            break
+        except OSError:
+            continue   # not a local address, or no multicast route; broadcasts still work
+    return sock
+
+
+def answer(sock, info):
+    # Waits for one datagram and answers it if it is a probe. info() returns
+    # the announce fields, so they follow the receiver's current config.
+    data, addr = sock.recvfrom(MAX_DATAGRAM)
+    try:
+        probe = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(probe, dict) or probe.get("type") != "discover":
+        return None
+    sock.sendto(json.dumps(make_announce(probe.get("nonce"), **info())).encode(), addr)
+    return addr
+
+
+# -----------------------
+# Sender side
+# -----------------------
+def discover(broadcasts=(), timeout=DISCOVERY_TIMEOUT, port=DISCOVERY_PORT):
+    # Returns the announces of every receiver that answered within timeout,
+    # first answer first, each with the address it answered from as "ip".
+    # The probe is sent a second time halfway through if nobody answered.
+    nonce = random.getrandbits(32)
+    probe = json.dumps(make_probe(nonce)).encode()
+    targets = ["255.255.255.255", MULTICAST_GROUP]
+    targets += [b for b in broadcasts if b not in targets]
+    found = {}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+
+        def send_probe():
+            sent = False
+            for target in targets:
+                try:
+                    sock.sendto(probe, (target, port))
+                    sent = True
+                except OSError:
+                    pass   # that network is unreachable from here
+            return sent
+
+        if not send_probe():
+            return []
+        start = time.monotonic()
+        retried = False
+        while True:
+            elapsed = time.monotonic() - start
+            if elapsed >= timeout:
+                break
+            if not retried and not found and elapsed >= timeout / 2:
+                retried = True
+                send_probe()
+            wake = timeout if retried or found else timeout / 2
+            sock.settimeout(max(0.001, wake - elapsed))
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                announce = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(announce, dict) or announce.get("type") != "receiver" or announce.get("nonce") != nonce:
+                continue
+            announce["ip"] = addr[0]
+            found.setdefault((addr[0], announce.get("port")), announce)
+    return list(found.values())
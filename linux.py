@@ -1,38 +1,28 @@
 import socket
-import json
 import threading
 import tkinter as tk
 from tkinter import ttk
 from evdev import UInput, ecodes as e
-import os
-import traceback
+import logging
+import selectors
+import time
+from array import array
+import protocol
+import ringlog
+import sessions
 
 # -----------------------
 # Config / constants
 # -----------------------
 SHOW_UI = True
 SERVER_PORT = 5000
-CONFIG_PORT = 5001
-CONFIG_PATH = "config.json"
-USE_RUMBLE = False
-SEND_FULL_STATE = False
-DEBUG = False
+CONFIG_PATH = "config.json"   # read and watched by sessions.Receiver
+SEND_TIMEOUT = 1.0
+STATS_INTERVAL = 1.0   # seconds between reports/events per second samples
+SUMMARY_INTERVAL = 10.0   # seconds between latency summaries in the log
 PC_IP = "192.168.1.10"
-if os.path.exists(CONFIG_PATH):
-    try:
-        with open(CONFIG_PATH, "r") as f:
-            cfg = json.load(f)
-            USE_UDP = cfg.get("USE_UDP", False)
-            USE_RUMBLE = cfg.get("USE_RUMBLE", False)
-            SEND_FULL_STATE = cfg.get("SEND_FULL_STATE", SEND_FULL_STATE)
-            DEBUG = cfg.get("DEBUG", DEBUG)
-            print(f"🛠️ Loaded config: Rumble={USE_RUMBLE}, FullState={SEND_FULL_STATE}, Debug={DEBUG}")
-    except Exception as ex:
-        print("❌ Error reading config:", ex)
+log = ringlog.setup("INFO")
 
-# -----------------------
-# evdev virtual device
-# -----------------------
 capabilities = {
     e.EV_KEY: [
         e.BTN_A, e.BTN_B, e.BTN_X, e.BTN_Y,
@@ -80,301 +70,530 @@ axis_map = {
     'GYRO_Z': e.ABS_WHEEL,   # Gyro yaw
 }
 
-def make_empty_state():
-    return {
-        'buttons': set(),
-        'axes': {
-            'LS_x': 0.0, 'LS_y': 0.0,
-            'RS_x': 0.0, 'RS_y': 0.0,
-            'LT': 0.0, 'RT': 0.0,
-            'GYRO_X': 0.0, 'GYRO_Y': 0.0, 'GYRO_Z': 0.0
-        },
-        'dpad': (0, 0)
-    }
+STATE_AXES = ('LS_x', 'LS_y', 'RS_x', 'RS_y', 'LT', 'RT', 'GYRO_X', 'GYRO_Y', 'GYRO_Z')
+
+class ControllerState:
+    # Last known pad state of one client, as the UI and metrics see it:
+    # bit n of buttons is BTN_n, axes holds one float per STATE_AXES name
+    # (sticks and gyro -1..1, triggers 0..1), the hat is two ints.
+    __slots__ = ('buttons', 'axes', 'hat_x', 'hat_y')
+
+    def __init__(self):
+        self.buttons = 0
+        self.axes = array('d', bytes(8 * len(STATE_AXES)))
+        self.hat_x = 0
+        self.hat_y = 0
+
+    def pressed(self, index):
+        return (self.buttons >> index) & 1
+
+    def axis(self, name):
+        return self.axes[STATE_AXES.index(name)]
+
+    def copy_into(self, other):
+        # Snapshot into an existing state without allocating
+        other.buttons = self.buttons
+        other.axes[:] = self.axes
+        other.hat_x = self.hat_x
+        other.hat_y = self.hat_y
+        return other
+
+    def copy(self):
+        return self.copy_into(ControllerState())
+
+class VirtualPad:
+    # A client's UInput plus the last value written for every key and axis.
+    # Writes that would not change anything never reach the kernel, and
+    # syn() only sends a SYN_REPORT when something was written since the
+    # last one. One per client, so each deck's dpad is tracked on its own.
+    __slots__ = ('ui', 'keys', 'abs', 'dirty', 'suppressed', 'reports')
+
+    def __init__(self, ui):
+        self.ui = ui
+        self.keys = {}
+        self.abs = {}
+        self.dirty = False
+        self.suppressed = 0
+        self.reports = 0
+
+    def write(self, etype, code, value):
+        last = self.keys if etype == e.EV_KEY else self.abs
+        if last.get(code) == value:
+            self.suppressed += 1
+            return
+        self.ui.write(etype, code, value)
+        last[code] = value
+        self.dirty = True
+
+    def syn(self):
+        if self.dirty:
+            self.dirty = False
+            self.ui.syn()
+            self.reports += 1
+
+    def reset(self):
+        # Back to a released pad: keys up, sticks centred, triggers out.
+        for code, value in list(self.keys.items()):
+            if value:
+                self.write(e.EV_KEY, code, 0)
+        for code in list(self.abs):
+            self.write(e.EV_ABS, code, RELEASED_ABS.get(code, 0))
+        self.syn()
+
+    def close(self):
+        self.ui.close()
+
+# Triggers span the full signed range, so released is the bottom of it.
+RELEASED_ABS = {e.ABS_Z: -32767, e.ABS_RZ: -32767}
+
+device_ids = iter(range(1, 1 << 30))
+
+def create_device():
+    return VirtualPad(UInput(capabilities, name=f"Virtual Gamepad -{next(device_ids)}", version=0x3, bustype=e.BUS_USB))
+
+# Force feedback isn't forwarded to decks, so rumble is never offered.
+server = sessions.Receiver("linux", create_device, VirtualPad.reset, VirtualPad.close,
+                           port=SERVER_PORT, gyro=True, rumble=False, config_path=CONFIG_PATH)
 
 # -----------------------
 # Global server state
 # -----------------------
-clients = {}
+# Pad state per client for the UI, guarded by server.lock
 client_states = {}
-clients_lock = threading.Lock()
-next_client_id = 1
+
+class ClientSession(sessions.Session):
+    def __init__(self, client_id, conn, addr):
+        super().__init__(client_id, conn, addr)
+        # evdev reports sent (at most one per frame, none when every write
+        # was skipped) and input values received, plus the per-second rates
+        # derived from them by stats_loop()
+        self.reports = 0
+        self.events = 0
+        self.report_rate = 0.0
+        self.event_rate = 0.0
+        self.rate_mark = (time.monotonic(), 0, 0)
+
+    def count(self, events, reports):
+        self.reports += reports
+        self.events += events
+
+    def update_rates(self, now):
+        then, reports, events = self.rate_mark
+        elapsed = now - then
+        if elapsed > 0:
+            self.report_rate = (self.reports - reports) / elapsed
+            self.event_rate = (self.events - events) / elapsed
+        self.rate_mark = (now, self.reports, self.events)
 
 root = None
 notebook = None
 client_tabs = {}
 status_label_var = None
 
-current_dpad_buttons = set()
-
-def handle_event(ui,client_id,code, value, target_state=None):
-    global current_dpad_buttons
-
-    if target_state is None:
-        pass
+# -----------------------
+# Compiled dispatch tables
+# -----------------------
+# button_map and axis_map are compiled once into tables indexed by the
+# button/axis number the deck sends. Each entry is
+# (handler, evdev code, scale, state slot), so a full_state frame is applied
+# with a plain indexed loop and named events need a single dict lookup.
+AXIS_SLOTS = {
+    'AXIS_0': STATE_AXES.index('LS_x'), 'AXIS_1': STATE_AXES.index('LS_y'),
+    'AXIS_3': STATE_AXES.index('RS_x'), 'AXIS_4': STATE_AXES.index('RS_y'),
+    'AXIS_2': STATE_AXES.index('LT'), 'AXIS_5': STATE_AXES.index('RT'),
+    'GYRO_X': STATE_AXES.index('GYRO_X'), 'GYRO_Y': STATE_AXES.index('GYRO_Y'),
+    'GYRO_Z': STATE_AXES.index('GYRO_Z'),
+}
 
-    # BUTTONS
-    if isinstance(code, str) and code.startswith("BTN_"):
-        ev = button_map.get(code)
-        if ev is not None:
-            try:
-                ui.write(e.EV_KEY, ev, int(bool(value)))
-                ui.syn()
-            except Exception as ex:
-                if DEBUG: print(f"❌ evdev write error for button {code}:", ex)
-        if target_state is not None:
-            if value:
-                target_state['buttons'].add(code)
-            else:
-                target_state['buttons'].discard(code)
+def scale_stick(value):
+    # -1..1 -> -32767..32767; larger values are taken as raw device units
+    if isinstance(value, (int, float)) and abs(float(value)) <= 1:
+        return int(round(float(value) * 32767.0))
+    return int(value)
+
+def scale_clamped(value):
+    # Triggers and gyro: clamp to -1..1 -> -32767..32767 (signed 16-bit)
+    if isinstance(value, (int, float)):
+        v = float(value)
+        if v < -1.0: v = -1.0
+        if v > 1.0: v = 1.0
+        return int(round(v * 32767.0))
+    return int(value)
+
+def write_button(ui, entry, value, target_state):
+    ev, slot = entry[1], entry[3]
+    if ev is not None:
+        try:
+            ui.write(e.EV_KEY, ev, int(bool(value)))
+        except Exception as ex:
+            log.debug("❌ evdev write error for button BTN_%d: %s", slot, ex)
+    if target_state is not None:
+        if value:
+            target_state.buttons |= 1 << slot
+        else:
+            target_state.buttons &= ~(1 << slot)
+
+def write_axis(ui, entry, value, target_state):
+    _, ev, scale, slot = entry
+    try:
+        ui.write(e.EV_ABS, ev, scale(value))
+    except Exception as ex:
+        log.debug("❌ evdev write error for axis %s: %s", slot, ex)
+    if target_state is not None:
+        target_state.axes[slot] = float(value) if isinstance(value, (int, float)) else 0.0
 
-    # AXES
-    elif isinstance(code, str) and code.startswith("AXIS_"):
-        ev = axis_map.get(code)
-        if isinstance(ev, int):
-            # If this is a trigger (ABS_Z or ABS_RZ) we map from -1..1 -> -32767..32767
-            if ev in (e.ABS_Z, e.ABS_RZ):
-                try:
-                    if isinstance(value, (int, float)):
-                        v = float(value)
-                        # clamp
-                        if v < -1.0: v = -1.0
-                        if v > 1.0: v = 1.0
-                        # map -1..1 -> -32767..32767 (signed 16-bit)
-                        scaled = int(round(v * 32767.0))
-                    else:
-                        scaled = int(value)
-                    ui.write(e.EV_ABS, ev, scaled)
-                    ui.syn()
-                except Exception as ex:
-                    if DEBUG: print(f"❌ evdev write error for trigger axis {code}:", ex)
-            else:
-                # Non-trigger axis (sticks): -1..1 -> -32767..32767
-                try:
-                    if isinstance(value, (int, float)) and abs(float(value)) <= 1:
-                        val = int(round(float(value) * 32767.0))
-                    else:
-                        val = int(value)
-                    ui.write(e.EV_ABS, ev, val)
-                    ui.syn()
-                except Exception as ex:
-                    if DEBUG: print(f"❌ evdev write error for axis {code}:", ex)
-
-        # update per-client UI state mapping
-        if target_state is not None:
-            if code == "AXIS_0":
-                target_state['axes']['LS_x'] = float(value) if isinstance(value, (int, float)) else 0.0
-            elif code == "AXIS_1":
-                target_state['axes']['LS_y'] = float(value) if isinstance(value, (int, float)) else 0.0
-            elif code == "AXIS_3":
-                target_state['axes']['RS_x'] = float(value) if isinstance(value, (int, float)) else 0.0
-            elif code == "AXIS_4":
-                target_state['axes']['RS_y'] = float(value) if isinstance(value, (int, float)) else 0.0
-            elif code == "AXIS_2":
-                try:
-                    v = float(value)
-                    target_state['axes']['LT'] = (v + 1.0) / 2.0
-                except:
-                    pass
-            elif code == "AXIS_5":
-                try:
-                    v = float(value)
-                    target_state['axes']['RT'] = (v + 1.0) / 2.0
-                except:
-                    pass
+def write_trigger(ui, entry, value, target_state):
+    _, ev, scale, slot = entry
+    try:
+        ui.write(e.EV_ABS, ev, scale(value))
+    except Exception as ex:
+        log.debug("❌ evdev write error for trigger axis %s: %s", slot, ex)
+    if target_state is not None:
+        try:
+            target_state.axes[slot] = (float(value) + 1.0) / 2.0
+        except:
+            pass
 
-    # GYRO/MOTION AXES
-    elif isinstance(code, str) and code.startswith("GYRO_"):
+def write_hat(ui, entry, value, target_state):
+    # Every dpad key is written with its target value; the client's
+    # VirtualPad drops the ones that did not change.
+    x, y = value
+    try:
+        ui.write(e.EV_KEY, e.BTN_DPAD_LEFT, int(x == -1))
+        ui.write(e.EV_KEY, e.BTN_DPAD_RIGHT, int(x == 1))
+        ui.write(e.EV_KEY, e.BTN_DPAD_UP, int(y == 1))
+        ui.write(e.EV_KEY, e.BTN_DPAD_DOWN, int(y == -1))
+        ui.write(e.EV_ABS, entry[1][0], x)
+        ui.write(e.EV_ABS, entry[1][1], y)
+    except Exception as ex:
+        log.debug("❌ evdev write error for hat: %s", ex)
+
+    if target_state is not None:
+        target_state.hat_x = x
+        target_state.hat_y = y
+
+def compile_tables():
+    buttons = []
+    for i in range(protocol.MAX_BUTTONS):
+        code = f"BTN_{i}"
+        buttons.append((write_button, button_map.get(code), None, i))
+    axes = []
+    for i in range(protocol.MAX_AXES):
+        code = f"AXIS_{i}"
         ev = axis_map.get(code)
-        if isinstance(ev, int):
-            try:
-                if isinstance(value, (int, float)):
-                    v = float(value)
-                    # Clamp and scale gyro data: -1..1 -> -32767..32767
-                    if v < -1.0: v = -1.0
-                    if v > 1.0: v = 1.0
-                    scaled = int(round(v * 32767.0))
-                else:
-                    scaled = int(value)
-                ui.write(e.EV_ABS, ev, scaled)
-                ui.syn()
-            except Exception as ex:
-                if DEBUG: print("❌ evdev write error for gyro:", ex)
-        
-        if target_state is not None:
-            if code == "GYRO_X":
-                target_state['axes']['GYRO_X'] = float(value) if isinstance(value, (int, float)) else 0.0
-            elif code == "GYRO_Y":
-                target_state['axes']['GYRO_Y'] = float(value) if isinstance(value, (int, float)) else 0.0
-            elif code == "GYRO_Z":
-                target_state['axes']['GYRO_Z'] = float(value) if isinstance(value, (int, float)) else 0.0
-
-    # HAT
-    elif code == "HAT_0":
-        x, y = value
-        for btn in list(current_dpad_buttons):
-            try:
-                ui.write(e.EV_KEY, btn, 0)
-            except:
-                pass
-        current_dpad_buttons.clear()
-
-        if x == -1:
-            ui.write(e.EV_KEY, e.BTN_DPAD_LEFT, 1); current_dpad_buttons.add(e.BTN_DPAD_LEFT)
-        elif x == 1:
-            ui.write(e.EV_KEY, e.BTN_DPAD_RIGHT, 1); current_dpad_buttons.add(e.BTN_DPAD_RIGHT)
-
-        if y == 1:
-            ui.write(e.EV_KEY, e.BTN_DPAD_UP, 1); current_dpad_buttons.add(e.BTN_DPAD_UP)
-        elif y == -1:
-            ui.write(e.EV_KEY, e.BTN_DPAD_DOWN, 1); current_dpad_buttons.add(e.BTN_DPAD_DOWN)
-
+        if not isinstance(ev, int):
+            axes.append(None)
+        elif ev in (e.ABS_Z, e.ABS_RZ):
+            axes.append((write_trigger, ev, scale_clamped, AXIS_SLOTS[code]))
+        else:
+            axes.append((write_axis, ev, scale_stick, AXIS_SLOTS[code]))
+    gyro = []
+    for name in protocol.GYRO_NAMES:
+        code = f"GYRO_{name}"
+        gyro.append((write_axis, axis_map[code], scale_clamped, AXIS_SLOTS[code]))
+    hat = (write_hat, axis_map['HAT_0'], None, None)
+
+    codes = {f"BTN_{i}": entry for i, entry in enumerate(buttons)}
+    codes.update((f"AXIS_{i}", entry) for i, entry in enumerate(axes) if entry is not None)
+    codes.update((f"GYRO_{name}", entry) for name, entry in zip(protocol.GYRO_NAMES, gyro))
+    codes['HAT_0'] = hat
+    return buttons, axes, gyro, hat, codes
+
+BUTTON_TABLE, AXIS_TABLE, GYRO_TABLE, HAT_ENTRY, CODE_TABLE = compile_tables()
+# Named events from sessions that didn't negotiate gyro
+NO_GYRO_CODE_TABLE = {code: entry for code, entry in CODE_TABLE.items() if entry not in GYRO_TABLE}
+
+def handle_event(ui,client_id,code, value, target_state=None, syn=True, codes=CODE_TABLE):
+    entry = codes.get(code)
+    if entry is None:
+        return
+    entry[0](ui, entry, value, target_state)
+    if syn and entry[1] is not None:
         try:
-            ui.write(e.EV_ABS, e.ABS_HAT0X, x)
-            ui.write(e.EV_ABS, e.ABS_HAT0Y, y)
             ui.syn()
         except Exception as ex:
-            if DEBUG: print(f"❌ evdev write error for hat:", ex)
-
-        if target_state is not None:
-            target_state['dpad'] = (x, y)
-
-def apply_full_state(ui,client_id,data, target_state=None):
+            log.debug("❌ evdev syn error for %s: %s", code, ex)
+
+def apply_gyro(ui, client_id, data, target_state=None, syn=True):
+    x, y, z = GYRO_TABLE
+    x[0](ui, x, data.get('x', 0), target_state)
+    y[0](ui, y, data.get('y', 0), target_state)
+    z[0](ui, z, data.get('z', 0), target_state)
+    if syn:
+        ui.syn()
+    return 3
+
+def apply_full_state(ui,client_id,data, target_state=None, gyro=True):
+    # The whole frame is one evdev report: a single SYN_REPORT at the end so
+    # readers never see a half-applied state.
+    count = 0
     try:
-        for i, val in enumerate(data.get('axes', [])):
-            handle_event(ui, client_id, f"AXIS_{i}", val, target_state=target_state)
-        for i, val in enumerate(data.get('buttons', [])):
-            handle_event(ui, client_id, f"BTN_{i}", val, target_state=target_state)
-        handle_event(ui, client_id, "HAT_0", data.get('hat', (0,0)), target_state=target_state)
+        axes = data.get('axes', ())
+        for i in range(min(len(axes), protocol.MAX_AXES)):
+            entry = AXIS_TABLE[i]
+            if entry is not None:
+                entry[0](ui, entry, axes[i], target_state)
+        buttons = data.get('buttons', ())
+        for i in range(min(len(buttons), protocol.MAX_BUTTONS)):
+            entry = BUTTON_TABLE[i]
+            entry[0](ui, entry, buttons[i], target_state)
+        write_hat(ui, HAT_ENTRY, data.get('hat', (0,0)), target_state)
+        count = len(axes) + len(buttons) + 1
         
         # Handle gyro if present
         gyro_data = data.get('gyro')
-        if gyro_data:
-            handle_event(ui, client_id, "GYRO_X", gyro_data.get('x', 0), target_state=target_state)
-            handle_event(ui, client_id, "GYRO_Y", gyro_data.get('y', 0), target_state=target_state)
-            handle_event(ui, client_id, "GYRO_Z", gyro_data.get('z', 0), target_state=target_state)
+        if gyro_data and gyro:
+            count += apply_gyro(ui, client_id, gyro_data, target_state=target_state, syn=False)
+        ui.syn()
     except Exception as ex:
-        if DEBUG:
-            print(f"❌ Error applying full state: {ex}")
-            traceback.print_exc()
+        log.debug("❌ Error applying full state: %s", ex, exc_info=True)
+    return count
+
+def dispatch_event(ui, client_id, event, st, gyro=True):
+    # Applies one frame as one evdev report; returns how many input values
+    # it carried (0 when nothing was written). Motion input is ignored
+    # unless the session negotiated gyro.
+    codes = CODE_TABLE if gyro else NO_GYRO_CODE_TABLE
+    etype = event.get('type')
+    if etype == 'gamepad':
+        d = event.get('data', {})
+        handle_event(ui,client_id,d.get('code'), d.get('state'), target_state=st, codes=codes)
+        return 1
+    elif etype == 'full_state':
+        return apply_full_state(ui,client_id,event.get('data', {}), target_state=st, gyro=gyro)
+    elif etype == 'gyro':
+        if not gyro:
+            return 0
+        return apply_gyro(ui, client_id, event.get('data', {}), target_state=st)
+    elif etype == 'batch':
+        # Every change from one sender tick lands in a single evdev report.
+        events = event.get('data', {}).get('events', [])
+        for code, state in events:
+            handle_event(ui, client_id, code, state, target_state=st, syn=False, codes=codes)
+        ui.syn()
+        return len(events)
+    elif etype == 'debug':
+        log.info("[DEBUG #%d] %s", client_id, event.get('data'))
+    else:
+        log.debug("[CLIENT %d] Unknown event type: %s", client_id, etype)
+    return 0
+
+def accept_client(conn, addr):
+    session = server.accept(conn, addr, ClientSession)
+    with server.lock:
+        client_states[session.client_id] = ControllerState()
+    create_client_tab(session.client_id, addr)
+    update_status_label()
+    return session
+
+def read_client(session):
+    # Reads once from the socket and handles every complete frame. Returns
+    # False when the client closed; raises when a reply can't be sent.
+    client_id = session.client_id
+    reader = session.reader
+    if reader.recv_from(session.conn) == 0:
+        return False
+    while True:
+        frame = reader.next_frame()
+        if frame is None:
+            return True
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("[CLIENT %d] %r", client_id, bytes(frame))
+        if not frame:
+            continue
+        try:
+            event = protocol.decode(frame, reader.codec)
+        except Exception as ex:
+            log.warning("❌ Client #%d %s decode error: %s -- raw: %r", client_id, reader.codec, ex, bytes(frame))
+            continue
+        if not isinstance(event, dict):
+            log.warning("❌ Client #%d sent a frame that isn't an object -- raw: %r", client_id, bytes(frame))
+            continue
+
+        if event.get('type') == 'hello':
+            server.negotiate(session, event.get('data', {}))
+            continue
+        if event.get('type') == 'ping':
+            server.answer_ping(session, event)
+            continue
+
+        if session.device is None:
+            # Older senders send no hello and get a device with their first frame.
+            server.open_client(session)
+        st = None
+        with server.lock:
+            st = client_states.get(client_id)
+        applied = True
+        try:
+            device = session.device
+            reports = device.reports
+            session.count(dispatch_event(device, client_id, event, st, session.gyro), device.reports - reports)
+        except Exception as ex:
+            applied = False
+            log.error("❌ Error processing event from client #%d: %s", client_id, ex, exc_info=server.config["DEBUG"])
+        ts = event.get('ts')
+        if ts is not None:
+            session.metrics.frame(ts, time.monotonic())
+
+        if not session.ack:
+            server.track_sync(session, event, applied)
+            continue
+        try:
+            server.reply(session)
+        except Exception as ex:
+            log.error("❌ Error sending to client #%d: %s", client_id, ex)
+            raise
+
+def close_client(session):
+    with server.lock:
+        client_states.pop(session.client_id, None)
+    remove_client_tab(session.client_id)
+    server.close(session)
+    update_status_label()
 
 def handle_client(conn, addr, client_id):
-    global clients, client_states
-    ui = UInput(capabilities, name=f"Virtual Gamepad -{client_id}", version=0x3, bustype=e.BUS_USB)
-    print(f"🔌 Client #{client_id} handler started for {addr}")
-    buffer = ""
+    with server.lock:
+        session = server.clients[client_id]
     try:
         conn.settimeout(None)
-        while True:
-            data = conn.recv(4096)
-            if not data:
-                print(f"⚠️ Client #{client_id} disconnected (no data).")
-                break
-            buffer += data.decode(errors='ignore')
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                line = line.strip()
-                print (line)
-                if not line:
-                    continue
-                try:
-                    event = json.loads(line)
-                except Exception as ex:
-                    print(f"❌ Client #{client_id} JSON decode error: {ex} -- raw: {line!r}")
-                    continue
-
-                st = None
-                with clients_lock:
-                    st = client_states.get(client_id)
-                try:
-                    etype = event.get('type')
-                    if etype == 'gamepad':
-                        d = event.get('data', {})
-                        handle_event(ui,client_id,d.get('code'), d.get('state'), target_state=st)
-                    elif etype == 'full_state':
-                        apply_full_state(ui,client_id,event.get('data', {}), target_state=st)
-                    elif etype == 'gyro':
-                        d = event.get('data', {})
-                        handle_event(ui, client_id, "GYRO_X", d.get('x', 0), target_state=st)
-                        handle_event(ui, client_id, "GYRO_Y", d.get('y', 0), target_state=st)
-                        handle_event(ui, client_id, "GYRO_Z", d.get('z', 0), target_state=st)
-                    elif etype == 'debug':
-                        print(f"[DEBUG #{client_id}] {event.get('data')}")
-                    else:
-                        if DEBUG:
-                            print(f"[CLIENT {client_id}] Unknown event type: {etype}")
-                except Exception as ex:
-                    print(f"❌ Error processing event from client #{client_id}: {ex}")
-                    if DEBUG:
-                        traceback.print_exc()
-
-                with clients_lock:
-                    client_count = len(clients)
-                response = {"CLIENT_ID": client_id, "CLIENT_COUNT": client_count}
-                try:
-                    conn.sendall((json.dumps(response) + "\n").encode())
-                except Exception as ex:
-                    print(f"❌ Error sending to client #{client_id}: {ex}")
-                    raise
+        while read_client(session):
+            pass
+        log.info("⚠️ Client #%d disconnected (no data).", client_id)
 
     except Exception as ex:
-        print(f"❌ Socket error in client #{client_id} handler: {ex}")
+        log.error("❌ Socket error in client #%d handler: %s", client_id, ex)
     finally:
-        try:
-            ui.close()
-            conn.close()
-        except:
-            pass
-        with clients_lock:
-            if client_id in clients: del clients[client_id]
-            if client_id in client_states: del client_states[client_id]
+        close_client(session)
 
-        remove_client_tab(client_id)
-        print(f"📴 Client #{client_id} disconnected. Connected clients: {len(clients)}")
-        update_status_label()
+def handle_datagram(data):
+    found = server.datagram(data)
+    if found is None:
+        return
+    session, event = found
+    with server.lock:
+        st = client_states.get(session.client_id)
+    applied = True
+    try:
+        device = session.device
+        reports = device.reports
+        session.count(dispatch_event(device, session.client_id, event, st, session.gyro), device.reports - reports)
+    except Exception as ex:
+        applied = False
+        log.error("❌ Error processing datagram from client #%d: %s", session.client_id, ex,
+                  exc_info=server.config["DEBUG"])
+    ts = event.get('ts')
+    if ts is not None:
+        session.metrics.frame(ts, time.monotonic())
+    try:
+        server.track_sync(session, event, applied)
+    except OSError as ex:
+        log.error("❌ Error sending to client #%d: %s", session.client_id, ex)
 
-def controller_server():
-    global next_client_id, clients
+def make_tcp_listener():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind((PC_IP, SERVER_PORT))
+    sock.bind((PC_IP, server.port))
     sock.listen(10)
-    print(f"🎮 Controller server listening on port {SERVER_PORT}")
+    return sock
+
+def make_udp_socket():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((PC_IP, server.port))
+    return sock
+
+def udp_server():
+    sock = make_udp_socket()
+    log.info("📶 UDP input listening on port %d", server.port)
+    while True:
+        try:
+            data, addr = sock.recvfrom(2048)
+            handle_datagram(data)
+        except Exception as ex:
+            log.error("❌ UDP receive error: %s", ex)
+
+def controller_server():
+    sock = make_tcp_listener()
+    log.info("🎮 Controller server listening on port %d", server.port)
     while True:
         try:
             conn, addr = sock.accept()
-            with clients_lock:
-                client_id = next_client_id
-                next_client_id += 1
-                clients[client_id] = (conn, addr)
-                client_states[client_id] = make_empty_state()
-            print(f"✅ New connection from {addr} assigned Client ID #{client_id}. Total clients: {len(clients)}")
-            create_client_tab(client_id, addr)
-            update_status_label()
-            t = threading.Thread(target=handle_client, args=(conn, addr, client_id), daemon=True)
+            session = accept_client(conn, addr)
+            t = threading.Thread(target=handle_client, args=(conn, addr, session.client_id), daemon=True)
             t.start()
         except Exception as ex:
-            print("❌ Socket accept error:", ex)
-
-def config_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((PC_IP, CONFIG_PORT))
-        s.listen(5)
-        print("📡 Config server running on port", CONFIG_PORT)
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                config_data = json.dumps({
-                    "USE_UDP": False,
-                    "SEND_FULL_STATE": SEND_FULL_STATE,
-                    "RUMBLE": USE_RUMBLE,
-                    "DEBUG": DEBUG
-                })
+            log.error("❌ Socket accept error: %s", ex)
+
+def selector_server():
+    # One loop for the listener, every client socket and the UDP socket;
+    # frames are decoded and written to evdev inline, without extra threads.
+    sel = selectors.DefaultSelector()
+    listener = make_tcp_listener()
+    listener.setblocking(False)
+    sel.register(listener, selectors.EVENT_READ, "accept")
+    if server.config["USE_UDP"]:
+        udp_sock = make_udp_socket()
+        udp_sock.setblocking(False)
+        sel.register(udp_sock, selectors.EVENT_READ, "udp")
+    log.info("🎮 Controller server listening on port %d (single event loop)", server.port)
+
+    while True:
+        for key, mask in sel.select():
+            if key.data == "accept":
+                try:
+                    conn, addr = listener.accept()
+                except OSError as ex:
+                    log.error("❌ Socket accept error: %s", ex)
+                    continue
+                # Readiness keeps recv from blocking; the timeout bounds how
+                # long a client that stopped reading can stall a reply.
+                conn.settimeout(SEND_TIMEOUT)
+                session = accept_client(conn, addr)
+                sel.register(conn, selectors.EVENT_READ, session)
+
+            elif key.data == "udp":
+                while True:
+                    try:
+                        data, addr = udp_sock.recvfrom(2048)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError as ex:
+                        log.error("❌ UDP receive error: %s", ex)
+                        break
+                    handle_datagram(data)
+
+            else:
+                session = key.data
                 try:
-                    conn.sendall((config_data + "\n").encode())
-                except Exception as e:
-                    print("❌ Error sending config:", e)
+                    if read_client(session):
+                        continue
+                    log.info("⚠️ Client #%d disconnected (no data).", session.client_id)
+                except Exception as ex:
+                    log.error("❌ Socket error in client #%d handler: %s", session.client_id, ex)
+                sel.unregister(session.conn)
+                close_client(session)
+
+def stats_loop():
+    last_summary = time.monotonic()
+    while True:
+        time.sleep(STATS_INTERVAL)
+        now = time.monotonic()
+        summary = now - last_summary >= SUMMARY_INTERVAL
+        if summary:
+            last_summary = now
+        for key in server.pool.expire(now):
+            log.info("⌛ Deck %s did not come back, its device goes back to the pool", key)
+        with server.lock:
+            clients = list(server.clients.values())
+        for session in clients:
+            session.update_rates(now)
+            if session.reports:
+                log.debug("📈 Client #%d: %.0f reports/s, %.0f events/s (%d reports total, %d unchanged writes skipped)",
+                          session.client_id, session.report_rate, session.event_rate, session.reports,
+                          session.device.suppressed if session.device is not None else 0)
+            if summary and (session.metrics.latency.count or session.metrics.rtt.count):
+                log.info("⏱️ Client #%d (%s, %s): %s", session.client_id, session.transport,
+                         "acked" if session.ack else "pipelined", session.metrics.summary())
 
 # UI helpers (unchanged)...
 def create_client_tab(client_id, addr):
@@ -388,9 +607,9 @@ def create_client_tab(client_id, addr):
         lbl.pack(anchor="w", pady=(4,0))
         btn_frame = tk.Frame(tab, bg="black")
         btn_frame.pack(side="left", padx=8, pady=8, anchor="n")
-        canvas = tk.Canvas(tab, width=420, height=300, bg="black")
+        canvas = tk.Canvas(tab, width=420, height=320, bg="black")
         canvas.pack(side="left", padx=6, pady=6)
-        client_tabs[client_id] = {'frame': tab, 'label': lbl, 'canvas': canvas}
+        client_tabs[client_id] = {'frame': tab, 'label': lbl, 'canvas': canvas, 'view': ControllerState()}
     try:
         root.after(0, _create)
     except Exception:
@@ -417,8 +636,7 @@ def update_status_label():
         return
     def _update():
         count = 0
-        with clients_lock:
-            count = len(clients)
+        count = server.client_count()
         if status_label_var is not None:
             status_label_var.set(f"Connected clients: {count}")
         try:
@@ -437,67 +655,66 @@ def draw_client_canvas(client_id):
     canvas = entry['canvas']
     canvas.delete("all")
     st = None
-    with clients_lock:
-        st = client_states.get(client_id)
+    with server.lock:
+        live = client_states.get(client_id)
+        session = server.clients.get(client_id)
+        if live is not None:
+            st = live.copy_into(entry['view'])
     if st is None:
         canvas.create_text(200, 140, text="No state yet", fill="white")
         return
     canvas.create_text(210, 18, text=f"Client #{client_id}", fill="white")
+    if session is not None:
+        canvas.create_text(210, 285, text=f"{session.report_rate:.0f} reports/s — {session.event_rate:.0f} events/s", fill="white")
+        m = session.metrics
+        canvas.create_text(210, 305, text=f"latency {m.latency.describe()} — jitter {m.jitter.describe()} — rtt {m.rtt.describe()}", fill="white")
 
-    def dpad_active(name):
-        x, y = st['dpad']
-        return (
-            (name == "HAT_0_UP" and y == 1) or
-            (name == "HAT_0_DOWN" and y == -1) or
-            (name == "HAT_0_LEFT" and x == -1) or
-            (name == "HAT_0_RIGHT" and x == 1)
-        )
-    def draw_btn(name, x, y):
-        color = "lime" if (name in st['buttons'] or dpad_active(name)) else "gray"
+    def draw_btn(active, x, y):
+        color = "lime" if active else "gray"
         canvas.create_oval(x-10, y-10, x+10, y+10, fill=color)
 
-    draw_btn("BTN_0", 300, 150)
-    draw_btn("BTN_1", 330, 120)
-    draw_btn("BTN_2", 270, 120)
-    draw_btn("BTN_3", 300, 90)
-    draw_btn("HAT_0_UP", 70, 100)
-    draw_btn("HAT_0_DOWN", 70, 140)
-    draw_btn("HAT_0_LEFT", 40, 120)
-    draw_btn("HAT_0_RIGHT", 100, 120)
-    draw_btn("BTN_4", 100, 40)
-    draw_btn("BTN_5", 300, 40)
-    draw_btn("BTN_6", 180, 100)
-    draw_btn("BTN_7", 220, 100)
-    draw_btn("BTN_8", 100, 200)
-    draw_btn("BTN_9", 300, 200)
-
-    # Triggers LT / RT (st['axes']['LT'] and RT are 0..1 floats)
+    draw_btn(st.pressed(0), 300, 150)
+    draw_btn(st.pressed(1), 330, 120)
+    draw_btn(st.pressed(2), 270, 120)
+    draw_btn(st.pressed(3), 300, 90)
+    draw_btn(st.hat_y == 1, 70, 100)
+    draw_btn(st.hat_y == -1, 70, 140)
+    draw_btn(st.hat_x == -1, 40, 120)
+    draw_btn(st.hat_x == 1, 100, 120)
+    draw_btn(st.pressed(4), 100, 40)
+    draw_btn(st.pressed(5), 300, 40)
+    draw_btn(st.pressed(6), 180, 100)
+    draw_btn(st.pressed(7), 220, 100)
+    draw_btn(st.pressed(8), 100, 200)
+    draw_btn(st.pressed(9), 300, 200)
+
+    # Triggers LT / RT (0..1 floats)
     canvas.create_text(70, 250, text="LT", fill="white")
     canvas.create_rectangle(100, 240, 150, 260, outline="white")
     try:
-        canvas.create_rectangle(100, 240, 100 + int(50 * float(st['axes']['LT'])), 260, fill="red")
+        canvas.create_rectangle(100, 240, 100 + int(50 * st.axis('LT')), 260, fill="red")
     except Exception:
         canvas.create_rectangle(100, 240, 100, 260, fill="red")
 
     canvas.create_text(250, 250, text="RT", fill="white")
     canvas.create_rectangle(280, 240, 330, 260, outline="white")
     try:
-        canvas.create_rectangle(280, 240, 280 + int(50 * float(st['axes']['RT'])), 260, fill="red")
+        canvas.create_rectangle(280, 240, 280 + int(50 * st.axis('RT')), 260, fill="red")
     except Exception:
         canvas.create_rectangle(280, 240, 280, 260, fill="red")
 
     # Left stick
     try:
-        lx = 100 + int(float(st['axes']['LS_x']) * 20)
-        ly = 200 + int(float(st['axes']['LS_y']) * 20)
+        lx = 100 + int(st.axis('LS_x') * 20)
+        ly = 200 + int(st.axis('LS_y') * 20)
         canvas.create_oval(lx-5, ly-5, lx+5, ly+5, fill="blue")
     except Exception:
         canvas.create_oval(95, 195, 105, 205, fill="blue")
 
     # Right stick
     try:
-        rx = 300 + int(float(st['axes']['RS_x']) * 20)
-        ry = 200 + int(float(st['axes']['RS_y']) * 20)
+        rx = 300 + int(st.axis('RS_x') * 20)
+        ry = 200 + int(st.axis('RS_y') * 20)
         canvas.create_oval(rx-5, ry-5, rx+5, ry+5, fill="blue")
     except Exception:
         canvas.create_oval(295, 195, 305, 205, fill="blue")
@@ -525,8 +742,19 @@ def run_ui():
     root.mainloop()
 
 if __name__ == "__main__":
-    threading.Thread(target=config_server, daemon=True).start()
-    threading.Thread(target=controller_server, daemon=True).start()
+    try:
+        server.pool.fill()
+    except Exception as ex:
+        log.error("❌ Could not pre-create virtual devices: %s", ex)
+    threading.Thread(target=server.watch_config, daemon=True).start()
+    threading.Thread(target=server.serve_discovery, args=(PC_IP,), daemon=True).start()
+    threading.Thread(target=stats_loop, daemon=True).start()
+    if server.config["SERVER_MODE"] == "selectors":
+        threading.Thread(target=selector_server, daemon=True).start()
+    else:
+        threading.Thread(target=controller_server, daemon=True).start()
+        if server.config["USE_UDP"]:
+            threading.Thread(target=udp_server, daemon=True).start()
     if SHOW_UI:
         run_ui()
     else:
@@ -0,0 +1,105 @@
+from bisect import bisect_left
+
+# -----------------------
+# Latency metrics
+# -----------------------
+# Fixed log-spaced histograms (10 buckets per decade from 0.05 ms to 10 s),
+# so recording a sample is one bisect and an increment, and percentiles
+# are read back without keeping the samples around. Percentiles report the
+# upper bound of the bucket they fall in, i.e. they are accurate to ~25%.
+BUCKETS_PER_DECADE = 10
+MIN_MS = 0.05
+MAX_MS = 10000.0
+PERCENTILES = (50, 95, 99)
+
+
+def _bounds():
+    bounds = []
+    step = 10 ** (1.0 / BUCKETS_PER_DECADE)
+    bound = MIN_MS
+    while bound < MAX_MS:
+        bounds.append(bound)
+        bound *= step
+    bounds.append(MAX_MS)
+    return bounds
+
+
+BOUNDS = _bounds()
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, ms):
+        self.counts[bisect_left(BOUNDS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return BOUNDS[i] if i < len(BOUNDS) else self.max
+        return self.max
+
+    def percentiles(self, ps=PERCENTILES):
+        return [self.percentile(p) for p in ps]
+
+    def describe(self):
+        if not self.count:
+            return "-"
+        return "/".join("%.1f" % v for v in self.percentiles()) + " ms"
+
+
+class LatencyMetrics:
+    # Per-client numbers: deck-to-write latency of timestamped frames, the
+    # jitter between consecutive latencies, and the round trips the deck
+    # measured with its clock probes. Latency needs a clock offset, so it is
+    # only recorded once the deck has sent one.
+    def __init__(self):
+        self.latency = Histogram()
+        self.jitter = Histogram()
+        self.rtt = Histogram()
+        self.offset = None
+        self.last_latency = None
+
+    def probe(self, rtt, offset):
+        if rtt is not None:
+            self.rtt.record(rtt * 1000.0)
+        if offset is not None:
+            self.offset = offset
+
+    def frame(self, ts, now):
+        if self.offset is None:
+            return
+        ms = (now - (ts + self.offset)) * 1000.0
+        if ms < 0:
+            ms = 0.0
+        self.latency.record(ms)
+        if self.last_latency is not None:
+            self.jitter.record(abs(ms - self.last_latency))
+        self.last_latency = ms
+
+    def summary(self):
+        return "latency p50/p95/p99 %s, jitter %s, rtt %s (%d frames)" % (
+            self.latency.describe(), self.jitter.describe(), self.rtt.describe(), self.latency.count)
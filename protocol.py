@@ -0,0 +1,535 @@
+import json
+import struct
+from collections import deque
+
+# -----------------------
+# Wire protocol
+# -----------------------
+# A client opens the TCP connection with a JSON "hello" line listing the
+# protocol versions and codecs it speaks. The receiver answers with a JSON
+# "welcome" line naming the ones it picked. Clients that skip the hello
+# (older senders) stay on newline-delimited JSON.
+#
+# By default the receiver answers every input frame with a status line and
+# the sender waits for it. A hello with "ack": false asks for pipelined
+# mode instead: frames are fire-and-forget and the receiver pushes "status"
+# (and "rumble") lines on its own whenever something changes. Replies are
+# always JSON lines, whatever codec the input frames use.
+#
+# The hello also says what the deck can do ("gyro", "rumble"); the welcome
+# answers with what this session will use (both sides must support it) and
+# with the receiver's "config" (SEND_FULL_STATE, SYNC_MODE, ...). When the
+# receiver's config.json changes it sends the new config to every session:
+# pushed as a "config" line to pipelined clients, and as a "config" field
+# of the next reply to acked ones.
+#
+# Binary frames are length-prefixed on the stream: <len:u16> <payload>.
+# Every payload starts with <version:u8> <type:u8> <flags:u8>.
+PROTOCOL_VERSION = 1
+SUPPORTED_VERSIONS = (1,)
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+SUPPORTED_CODECS = (CODEC_BINARY, CODEC_JSON)
+
+# Hybrid sync mode numbers every input frame ("seq"). The sender sends, each
+# tick, every field that changed since the last frame the receiver acked,
+# plus a full_state keyframe every KEYFRAME_INTERVAL_MS. A pipelined
+# receiver pushes "ack" lines at a bounded rate and a "resync" line when the
+# numbering skips, which makes the sender send a keyframe right away.
+SYNC_FULL = "full"
+SYNC_DELTA = "delta"
+SYNC_HYBRID = "hybrid"
+ACK_INTERVAL = 0.02
+RESYNC_INTERVAL = 0.1
+
+# With the UDP transport the TCP connection stays open as the session's
+# control channel and input frames travel as datagrams:
+# <magic:u8> <version:u8> <session:u32> <seq:u32> <frame>, where <frame>
+# is a binary payload without its length prefix, or one JSON document.
+# Receivers drop datagrams older than the last one applied, so senders only
+# send full_state or hybrid frames over UDP, never bare deltas. Datagrams
+# get no reply, so only pipelined sessions use UDP; acked ones stay on TCP.
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UDP = "udp"
+DATAGRAM_MAGIC = 0xDC
+
+# Latency probes. Input frames may carry "ts", the sender's time.monotonic()
+# when the frame was sampled. Once a second the sender sends a "ping" on the
+# TCP connection with its clock ("t"); the receiver answers "pong" with "t"
+# and its own clock ("rt"). From that round trip the sender estimates the
+# offset between the two clocks and reports it, with the round trip, in the
+# next ping, so the receiver can turn "ts" into deck-to-write latency.
+PROBE_INTERVAL = 1.0
+PROBE_WINDOW = 8
+
+MSG_FULL_STATE = 1
+MSG_GAMEPAD = 2
+MSG_GYRO = 3
+MSG_BATCH = 4     # <count:u8> then count gamepad records, applied as one report
+MSG_JSON = 0x7F   # anything the fixed layouts can't carry (debug text, ...)
+
+FLAG_GYRO = 0x01
+FLAG_SEQ = 0x02   # a <seq:u32> follows the header (hybrid sync)
+FLAG_TS = 0x04    # a <ts:f64> follows the header (and seq) (latency probes)
+
+KIND_AXIS = 0
+KIND_BTN = 1
+KIND_HAT = 2
+KIND_GYRO = 3
+
+MAX_AXES = 8
+MAX_BUTTONS = 32
+MAX_FRAME = 0xFFFF   # longest binary payload the <len:u16> prefix can carry
+AXIS_SCALE = 32767.0
+GYRO_NAMES = ("X", "Y", "Z")
+
+_LENGTH = struct.Struct("<H")
+_HEADER = struct.Struct("<BBB")
+_FULL_STATE = struct.Struct("<BB%dhIB" % MAX_AXES)   # n_axes, n_buttons, axes, button mask, hat
+_GAMEPAD = struct.Struct("<BBh")                     # kind, index, value
+_GYRO = struct.Struct("<3h")
+_COUNT = struct.Struct("<B")
+_SEQ = struct.Struct("<I")
+_TS = struct.Struct("<d")
+_DATAGRAM = struct.Struct("<BBII")
+MAX_DATAGRAM_FRAME = 65507 - _DATAGRAM.size   # largest UDP payload over IPv4, minus our header
+SEQ_MASK = 0xFFFFFFFF
+
+
+def scale_axis(value):
+    v = float(value)
+    if v < -1.0: v = -1.0
+    if v > 1.0: v = 1.0
+    return int(round(v * AXIS_SCALE))
+
+
+def unscale_axis(raw):
+    return raw / AXIS_SCALE
+
+
+def pack_hat(hat):
+    x, y = hat
+    return (int(x) + 1) | ((int(y) + 1) << 2)
+
+
+def unpack_hat(packed):
+    return [(packed & 3) - 1, ((packed >> 2) & 3) - 1]
+
+
+# -----------------------
+# Handshake
+# -----------------------
+def make_hello(codecs=SUPPORTED_CODECS, versions=SUPPORTED_VERSIONS, transports=(TRANSPORT_TCP,), ack=True,
+               client=None, gyro=False, rumble=False):
+    # client is a stable key for the deck; a receiver that sees it again
+    # after a reconnect hands back the same virtual pad ("resumed" in the
+    # welcome).
+    data = {"versions": list(versions), "codecs": list(codecs), "transports": list(transports), "ack": ack,
+            "gyro": gyro, "rumble": rumble}
+    if client:
+        data["client"] = client
+    return {"type": "hello", "data": data}
+
+
+def pick_transport(hello_data, use_udp):
+    acked = hello_data.get("ack", True)
+    if use_udp and not acked and TRANSPORT_UDP in hello_data.get("transports", []):
+        return TRANSPORT_UDP
+    return TRANSPORT_TCP
+
+
+def negotiate(hello_data, codecs=SUPPORTED_CODECS, versions=SUPPORTED_VERSIONS):
+    # Highest common version, and the client's most preferred codec we support.
+    offered = hello_data.get("versions") or [hello_data.get("version", 1)]
+    common = [v for v in offered if v in versions]
+    version = max(common) if common else None
+    codec = CODEC_JSON
+    for c in hello_data.get("codecs", []):
+        if c in codecs:
+            codec = c
+            break
+    return version, codec
+
+
+def pick_capabilities(hello_data, gyro, rumble):
+    # What the session will use: only what the deck offered and we support.
+    return bool(gyro and hello_data.get("gyro")), bool(rumble and hello_data.get("rumble"))
+
+
+# Lines a receiver sends on its own rather than as the reply to a frame.
+# One can reach a deck ahead of the welcome, so the handshake skips them.
+PUSHED_TYPES = ("status", "config", "rumble", "ack", "resync", "pong")
+
+
+def make_config(config):
+    return {"type": "config", "data": config}
+
+
+def make_status(**fields):
+    return {"type": "status", "data": fields}
+
+
+def encode_reply(payload):
+    return (json.dumps(payload) + "\n").encode()
+
+
+def make_welcome(version, codec, **extra):
+    data = {"version": version, "codec": codec}
+    data.update(extra)
+    return {"type": "welcome", "data": data}
+
+
+# -----------------------
+# Encoding
+# -----------------------
+def encode(payload, codec=CODEC_JSON):
+    return frame_stream(encode_frame(payload, codec), codec)
+
+
+def encode_frame(payload, codec=CODEC_JSON):
+    # The frame without its stream framing, as a datagram carries it.
+    if codec == CODEC_BINARY:
+        return encode_binary(payload)
+    return json.dumps(payload).encode()
+
+
+def frame_stream(frame, codec=CODEC_JSON):
+    if codec == CODEC_BINARY:
+        if len(frame) > MAX_FRAME:
+            raise ValueError("frame of %d bytes does not fit the length prefix" % len(frame))
+        return _LENGTH.pack(len(frame)) + frame
+    return frame + b"\n"
+
+
+def encode_binary(payload):
+    etype = payload.get("type")
+    data = payload.get("data")
+    try:
+        if etype == "full_state":
+            mtype, flags, body = _encode_full_state(data)
+        elif etype == "gamepad":
+            mtype, flags, body = MSG_GAMEPAD, 0, _pack_event(data["code"], data["state"])
+        elif etype == "gyro":
+            mtype, flags, body = MSG_GYRO, 0, _pack_gyro(data)
+        elif etype == "batch":
+            mtype, flags, body = _encode_batch(data)
+        else:
+            raise ValueError("no binary layout for %r" % etype)
+        seq = payload.get("seq")
+        ts = payload.get("ts")
+        if seq is None and ts is None:
+            return _HEADER.pack(PROTOCOL_VERSION, mtype, flags) + body
+        extra = b""
+        if seq is not None:
+            flags |= FLAG_SEQ
+            extra = _SEQ.pack(seq & SEQ_MASK)
+        if ts is not None:
+            flags |= FLAG_TS
+            extra += _TS.pack(ts)
+        return _HEADER.pack(PROTOCOL_VERSION, mtype, flags) + extra + body
+    except (ValueError, TypeError, KeyError, struct.error):
+        pass
+    return _HEADER.pack(PROTOCOL_VERSION, MSG_JSON, 0) + json.dumps(payload).encode()
+
+
+def _pack_gyro(gyro):
+    return _GYRO.pack(scale_axis(gyro.get("x", 0)), scale_axis(gyro.get("y", 0)), scale_axis(gyro.get("z", 0)))
+
+
+def _encode_full_state(data):
+    axes = data.get("axes", [])
+    buttons = data.get("buttons", [])
+    if len(axes) > MAX_AXES or len(buttons) > MAX_BUTTONS:
+        raise ValueError("frame does not fit the fixed layout")
+    raw_axes = [scale_axis(v) for v in axes]
+    raw_axes.extend([0] * (MAX_AXES - len(raw_axes)))
+    mask = 0
+    for i, pressed in enumerate(buttons):
+        if pressed:
+            mask |= 1 << i
+    gyro = data.get("gyro")
+    flags = FLAG_GYRO if gyro else 0
+    body = _FULL_STATE.pack(len(axes), len(buttons), *raw_axes, mask, pack_hat(data.get("hat", (0, 0))))
+    if gyro:
+        body += _pack_gyro(gyro)
+    return MSG_FULL_STATE, flags, body
+
+
+def _pack_event(code, state):
+    prefix, _, suffix = code.rpartition("_")
+    if prefix == "AXIS":
+        return _GAMEPAD.pack(KIND_AXIS, int(suffix), scale_axis(state))
+    if prefix == "BTN":
+        return _GAMEPAD.pack(KIND_BTN, int(suffix), int(bool(state)))
+    if prefix == "HAT":
+        return _GAMEPAD.pack(KIND_HAT, int(suffix), pack_hat(state))
+    if prefix == "GYRO":
+        return _GAMEPAD.pack(KIND_GYRO, GYRO_NAMES.index(suffix), scale_axis(state))
+    raise ValueError("unsupported code %r" % code)
+
+
+def _encode_batch(data):
+    events = data["events"]
+    parts = [_COUNT.pack(len(events))]
+    for code, state in events:
+        parts.append(_pack_event(code, state))
+    return MSG_BATCH, 0, b"".join(parts)
+
+
+# -----------------------
+# Decoding
+# -----------------------
+def decode(frame, codec=CODEC_JSON):
+    if codec == CODEC_BINARY:
+        return decode_binary(frame)
+    if isinstance(frame, memoryview):
+        frame = frame.tobytes()
+    return json.loads(frame)
+
+
+def decode_binary(body):
+    version, mtype, flags = _HEADER.unpack_from(body, 0)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError("unsupported protocol version %d" % version)
+    offset = _HEADER.size
+    seq = ts = None
+    if mtype != MSG_JSON:
+        if flags & FLAG_SEQ:
+            (seq,) = _SEQ.unpack_from(body, offset)
+            offset += _SEQ.size
+        if flags & FLAG_TS:
+            (ts,) = _TS.unpack_from(body, offset)
+            offset += _TS.size
+    event = _decode_body(body, offset, mtype, flags)
+    if seq is not None:
+        event["seq"] = seq
+    if ts is not None:
+        event["ts"] = ts
+    return event
+
+
+def _decode_body(body, offset, mtype, flags):
+    if mtype == MSG_FULL_STATE:
+        fields = _FULL_STATE.unpack_from(body, offset)
+        n_axes, n_buttons = fields[0], fields[1]
+        mask = fields[2 + MAX_AXES]
+        data = {
+            "axes": [unscale_axis(v) for v in fields[2:2 + n_axes]],
+            "buttons": [(mask >> i) & 1 for i in range(n_buttons)],
+            "hat": unpack_hat(fields[3 + MAX_AXES]),
+        }
+        if flags & FLAG_GYRO:
+            x, y, z = _GYRO.unpack_from(body, offset + _FULL_STATE.size)
+            data["gyro"] = {"x": unscale_axis(x), "y": unscale_axis(y), "z": unscale_axis(z)}
+        return {"type": "full_state", "data": data}
+
+    if mtype == MSG_GAMEPAD:
+        code, state = _unpack_event(*_GAMEPAD.unpack_from(body, offset))
+        return {"type": "gamepad", "data": {"code": code, "state": state}}
+
+    if mtype == MSG_BATCH:
+        (count,) = _COUNT.unpack_from(body, offset)
+        offset += _COUNT.size
+        events = []
+        for _ in range(count):
+            events.append(_unpack_event(*_GAMEPAD.unpack_from(body, offset)))
+            offset += _GAMEPAD.size
+        return {"type": "batch", "data": {"events": events}}
+
+    if mtype == MSG_GYRO:
+        x, y, z = _GYRO.unpack_from(body, offset)
+        return {"type": "gyro", "data": {"x": unscale_axis(x), "y": unscale_axis(y), "z": unscale_axis(z)}}
+
+    if mtype == MSG_JSON:
+        return json.loads(bytes(body[offset:]))
+
+    raise ValueError("unknown message type %d" % mtype)
+
+
+def _unpack_event(kind, index, value):
+    if kind == KIND_AXIS:
+        return f"AXIS_{index}", unscale_axis(value)
+    if kind == KIND_BTN:
+        return f"BTN_{index}", value
+    if kind == KIND_HAT:
+        return f"HAT_{index}", unpack_hat(value)
+    if kind == KIND_GYRO:
+        return f"GYRO_{GYRO_NAMES[index]}", unscale_axis(value)
+    raise ValueError("unknown gamepad kind %d" % kind)
+
+
+# -----------------------
+# Stream framing
+# -----------------------
+RECV_SIZE = 4096
+MAX_BUFFER = 1 << 20
+
+
+class FrameReader:
+    # Incremental framer for one stream. recv_into() writes straight into
+    # the free tail of a bytearray, delimiters are searched from where the
+    # last search stopped, and frames come out as memoryview slices, so
+    # each received byte is scanned and copied a bounded number of times.
+    # A frame is only valid until the next read.
+    def __init__(self, codec=CODEC_JSON, size=RECV_SIZE * 4):
+        self.codec = codec
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0   # first unconsumed byte
+        self.end = 0     # end of received data
+        self.scan = 0    # where the next delimiter search resumes
+
+    def recv_from(self, sock):
+        # Returns the number of bytes read; 0 means the peer closed.
+        self._reserve(RECV_SIZE)
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        self._reserve(len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def pending(self):
+        return self.end - self.start
+
+    def next_frame(self):
+        # Returns the next complete frame, or None until more data arrives.
+        # The codec is read on every call, so it may change between frames.
+        if self.codec == CODEC_BINARY:
+            if self.end - self.start < _LENGTH.size:
+                return None
+            (length,) = _LENGTH.unpack_from(self.buf, self.start)
+            first = self.start + _LENGTH.size
+            if self.end - first < length:
+                return None
+            self.start = self.scan = first + length
+            return self.view[first:self.start]
+
+        i = self.buf.find(b"\n", self.scan, self.end)
+        if i < 0:
+            self.scan = self.end
+            return None
+        first, last = self.start, i
+        if last > first and self.buf[last - 1] == 0x0D:
+            last -= 1
+        self.start = self.scan = i + 1
+        return self.view[first:last]
+
+    def _reserve(self, need):
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+        if len(self.buf) - self.end >= need:
+            return
+        # Move the unconsumed tail (at most one partial frame) to the front,
+        # into a bigger buffer if it still would not fit.
+        pending = self.end - self.start
+        size = len(self.buf)
+        while size - pending < need:
+            size *= 2
+        if size > MAX_BUFFER:
+            raise ValueError("frame larger than %d bytes" % MAX_BUFFER)
+        if size == len(self.buf):
+            self.buf[:pending] = self.buf[self.start:self.end]
+        else:
+            buf = bytearray(size)
+            buf[:pending] = self.view[self.start:self.end]
+            self.buf = buf
+            self.view = memoryview(buf)
+        self.scan -= self.start
+        self.start = 0
+        self.end = pending
+
+
+class SyncTracker:
+    # Receiver side of hybrid sync, one per client.
+    def __init__(self):
+        self.last_seq = None
+        self.last_ack = 0.0
+        self.last_resync = 0.0
+        self.gaps = 0
+
+    def frame(self, seq, now, applied=True):
+        # Returns the control messages to push for a frame that carried seq.
+        replies = []
+        if not seq_newer(seq, self.last_seq):
+            return replies
+        gap = self.last_seq is not None and seq != (self.last_seq + 1) & SEQ_MASK
+        self.last_seq = seq
+        if gap:
+            self.gaps += 1
+        if (gap or not applied) and now - self.last_resync >= RESYNC_INTERVAL:
+            self.last_resync = now
+            replies.append({"type": "resync", "data": {"seq": seq}})
+        if now - self.last_ack >= ACK_INTERVAL:
+            self.last_ack = now
+            replies.append({"type": "ack", "data": {"seq": seq}})
+        return replies
+
+
+# -----------------------
+# Clock probes
+# -----------------------
+def make_pong(ping_data, now):
+    return {"type": "pong", "data": {"t": ping_data.get("t"), "rt": now}}
+
+
+class ClockSync:
+    # Sender side of the clock probes. Every pong gives a round trip and an
+    # NTP-style estimate of (receiver clock - sender clock); the estimate
+    # from the fastest of the last PROBE_WINDOW round trips is the one least
+    # skewed by queueing, so that is the offset reported.
+    def __init__(self):
+        self.samples = deque(maxlen=PROBE_WINDOW)
+        self.rtt = None
+        self.offset = None
+        self.last_ping = 0.0
+
+    def due(self, now):
+        return now - self.last_ping >= PROBE_INTERVAL
+
+    def ping(self, now):
+        self.last_ping = now
+        return {"type": "ping", "data": {"t": now, "rtt": self.rtt, "offset": self.offset}}
+
+    def pong(self, data, now):
+        t0 = data.get("t")
+        remote = data.get("rt")
+        if t0 is None or remote is None:
+            return
+        self.rtt = now - t0
+        self.samples.append((self.rtt, remote - (t0 + now) / 2.0))
+        self.offset = min(self.samples)[1]
+
+
+# -----------------------
+# Datagrams
+# -----------------------
+def encode_datagram(session, seq, payload, codec=CODEC_JSON):
+    return frame_datagram(session, seq, encode_frame(payload, codec))
+
+
+def frame_datagram(session, seq, frame):
+    if len(frame) > MAX_DATAGRAM_FRAME:
+        raise ValueError("frame of %d bytes does not fit a datagram" % len(frame))
+    return _DATAGRAM.pack(DATAGRAM_MAGIC, PROTOCOL_VERSION, session, seq & SEQ_MASK) + frame
+
+
+def decode_datagram(data):
+    # Returns (session, seq, frame); raises ValueError on foreign traffic.
+    if len(data) < _DATAGRAM.size:
+        raise ValueError("short datagram")
+    magic, version, session, seq = _DATAGRAM.unpack_from(data, 0)
+    if magic != DATAGRAM_MAGIC or version not in SUPPORTED_VERSIONS:
+        raise ValueError("not a controller datagram")
+    return session, seq, data[_DATAGRAM.size:]
+
+
+def seq_newer(seq, last):
+    # Serial-number comparison, so the counter may wrap around.
+    if last is None:
+        return True
+    diff = (seq - last) & SEQ_MASK
+    return 0 < diff < 0x80000000
@@ -0,0 +1,133 @@
+import argparse
+import socket
+import sys
+import threading
+import time
+
+import protocol
+import capture
+
+# -----------------------
+# Capture replayer
+# -----------------------
+# Streams a capture made with sender.py's CAPTURE_PATH to a receiver, as if
+# the deck were sending it:
+#
+#   python replay.py session.dcap --host 192.168.1.10            original speed
+#   python replay.py session.dcap --host 192.168.1.10 --speed 4  4x faster
+#   python replay.py session.dcap --host 192.168.1.10 --speed 0  as fast as possible
+#   python replay.py session.dcap --dump                         print the frames
+#
+# Frames are sent byte for byte when the receiver picks the codec they were
+# captured in, and re-encoded otherwise. Captures are memory-mapped unless
+# --no-mmap is given.
+SERVER_PORT = 5000
+
+
+def connect(host, port, codec, pipelined):
+    sock = socket.create_connection((host, port), timeout=5)
+    sock.settimeout(None)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    reader = protocol.FrameReader()
+    codecs = [codec] + [c for c in protocol.SUPPORTED_CODECS if c != codec]
+    sock.sendall(protocol.encode(protocol.make_hello(codecs, ack=not pipelined)))
+    reply = read_reply(sock, reader)
+    while reply.get("type") in protocol.PUSHED_TYPES:
+        reply = read_reply(sock, reader)
+    # Receivers without a handshake just ack the hello like any other line.
+    if reply.get("type") != "welcome":
+        return sock, reader, protocol.CODEC_JSON, False
+    welcome = reply.get("data", {})
+    return sock, reader, welcome.get("codec", protocol.CODEC_JSON), welcome.get("ack") is False
+
+
+def read_reply(sock, reader):
+    while True:
+        line = reader.next_frame()
+        if line:
+            return protocol.decode(line)
+        if line is None and reader.recv_from(sock) == 0:
+            raise ConnectionError("receiver closed the connection")
+
+
+def discard_replies(sock, reader):
+    # Pipelined receivers push status/ack lines; keep the socket drained.
+    try:
+        while reader.recv_from(sock):
+            while reader.next_frame() is not None:
+                pass
+    except OSError:
+        pass
+
+
+def dump(path, use_mmap):
+    for t, codec, frame in capture.read_records(path, use_mmap):
+        if codec == protocol.CODEC_BINARY:
+            frame = frame[2:]   # drop the stream length prefix
+        print("%10.4f %s" % (t, protocol.decode(frame, codec)))
+
+
+def first_codec(path, use_mmap):
+    for _, codec, _ in capture.read_records(path, use_mmap):
+        return codec
+    return protocol.CODEC_JSON
+
+
+def replay(args):
+    codec = first_codec(args.capture, not args.no_mmap)
+    sock, reader, codec, pipelined = connect(args.host, args.port, codec, args.pipelined)
+    print(f"▶️ Replaying {args.capture} to {args.host}:{args.port} ({codec}, {'pipelined' if pipelined else 'acked'}, "
+          f"{'max speed' if args.speed <= 0 else '%gx' % args.speed})")
+    if pipelined:
+        threading.Thread(target=discard_replies, args=(sock, reader), daemon=True).start()
+
+    frames = 0
+    behind = 0.0
+    start = None
+    try:
+        for t, frame_codec, frame in capture.read_records(args.capture, not args.no_mmap):
+            if start is None:
+                start, first = time.monotonic(), t
+            if args.speed > 0:
+                due = start + (t - first) / args.speed
+                now = time.monotonic()
+                if due > now:
+                    time.sleep(due - now)
+                else:
+                    behind = max(behind, now - due)
+            if frame_codec != codec:
+                body = frame[2:] if frame_codec == protocol.CODEC_BINARY else frame
+                frame = protocol.encode(protocol.decode(body, frame_codec), codec)
+            sock.sendall(frame)
+            if not pipelined:
+                read_reply(sock, reader)
+            frames += 1
+    finally:
+        sock.close()
+    elapsed = time.monotonic() - start if start is not None else 0.0
+    rate = frames / elapsed if elapsed > 0 else 0.0
+    print(f"✅ {frames} frames in {elapsed:.2f}s ({rate:.0f} frames/s, at most {behind * 1000:.1f} ms behind schedule)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a sender capture to a receiver")
+    parser.add_argument("capture", help="capture file written by sender.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed; 0 sends as fast as possible")
+    parser.add_argument("--pipelined", action="store_true", help="don't wait for a reply after every frame")
+    parser.add_argument("--no-mmap", action="store_true", help="read the capture sequentially instead of mapping it")
+    parser.add_argument("--dump", action="store_true", help="print the captured frames instead of sending them")
+    args = parser.parse_args()
+    try:
+        if args.dump:
+            dump(args.capture, not args.no_mmap)
+        else:
+            replay(args)
+    except (ValueError, OSError) as ex:
+        print("❌", ex)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import atexit
+import logging
+import sys
+import threading
+from collections import deque
+
+# -----------------------
+# Non-blocking logging
+# -----------------------
+# Records go into a bounded in-memory ring and a background thread formats
+# and writes them, so a slow terminal or journald never stalls the thread
+# that is applying input. When the ring is full new records are dropped and
+# counted; the writer reports the count once it catches up.
+LOGGER_NAME = "deckcontroller"
+RING_SIZE = 2048
+FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+
+class RingHandler(logging.Handler):
+    def __init__(self, capacity=RING_SIZE, stream=None):
+        super().__init__()
+        self.capacity = capacity
+        self.stream = stream or sys.stdout
+        self.records = deque()
+        self.dropped = 0
+        self.reported = 0
+        self.wakeup = threading.Event()
+        self.write_lock = threading.Lock()
+        threading.Thread(target=self._writer, name="log-writer", daemon=True).start()
+
+    def handle(self, record):
+        # No handler lock here: deque appends are atomic and the caller must
+        # never wait for the writer.
+        if self.filter(record):
+            self.emit(record)
+        return True
+
+    def emit(self, record):
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return
+        self.records.append(record)
+        self.wakeup.set()
+
+    def flush(self):
+        with self.write_lock:
+            self._drain()
+
+    def _writer(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.write_lock:
+                self._drain()
+
+    def _drain(self):
+        records = self.records
+        while records:
+            record = records.popleft()
+            try:
+                self.stream.write(self.format(record) + "\n")
+            except Exception:
+                pass
+        dropped = self.dropped
+        if dropped != self.reported:
+            try:
+                self.stream.write(f"⚠️ Log buffer full, {dropped - self.reported} records dropped ({dropped} total)\n")
+            except Exception:
+                pass
+            self.reported = dropped
+        try:
+            self.stream.flush()
+        except Exception:
+            pass
+
+
+def setup(level="INFO", capacity=RING_SIZE):
+    log = logging.getLogger(LOGGER_NAME)
+    if not any(isinstance(h, RingHandler) for h in log.handlers):
+        handler = RingHandler(capacity)
+        handler.setFormatter(logging.Formatter(FORMAT, "%H:%M:%S"))
+        log.addHandler(handler)
+        log.propagate = False
+        atexit.register(handler.flush)
+    set_level(level)
+    return log
+
+
+def set_level(level):
+    log = logging.getLogger(LOGGER_NAME)
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+    log.setLevel(level)
+
+
+def dropped():
+    for h in logging.getLogger(LOGGER_NAME).handlers:
+        if isinstance(h, RingHandler):
+            return h.dropped
+    return 0
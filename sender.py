@@ -3,45 +3,217 @@ import socket
 import json
 import time
 import sys
+import os
 import tkinter as tk
 from tkinter import simpledialog
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import random
+import selectors
+import errno
+import struct
 import ipaddress
+import uuid
+from collections import deque
+import protocol
+import capture
+import discovery
 
 SERVER_IP = ""
 SERVER_PORT = 5000
-CONFIG_PORT = 5001
-RETRY_DELAY = 3
+RETRY_DELAY = 3         # longest wait between reconnect attempts
+RECONNECT_DELAY = 0.02  # first wait; doubles, with jitter, up to RETRY_DELAY
+CONNECT_TIMEOUT = 1.0
 SCAN_TIMEOUT = 1
+SCAN_PARALLEL = 256   # connects in flight at once during the fallback sweep
+SCAN_MIN_PREFIX = 22  # larger networks are only swept around our own address
 
 SEND_FULL_STATE = False
+SYNC_MODE = None   # "full", "delta" or "hybrid"; None follows SEND_FULL_STATE
+KEYFRAME_INTERVAL_MS = 500
 DEBUG = True
+sync_mode = None   # what is in use: the receiver's SYNC_MODE, else ours
+
+# Preferred wire codec; set to "json" to force the text protocol.
+WIRE_CODEC = protocol.CODEC_BINARY
+codec = protocol.CODEC_JSON
+
+# Set by the receiver's welcome when its config enables USE_UDP.
+transport = protocol.TRANSPORT_TCP
+udp_sock = None
+udp_addr = None
+udp_session = 0
+udp_seq = 0
+
+# Pipelined mode: frames are fire-and-forget and the receiver pushes status
+# and rumble on its own. Set to False to wait for a reply after every frame.
+PIPELINED = True
+SEND_QUEUE_LEN = 8
+pipeline = None
+server_status = {}
+rumble_handler = None
+rumble_enabled = True   # off when the receiver's welcome says no rumble
+hybrid_sync = None
+reply_reader = protocol.FrameReader()
+
+# Latency probes (see protocol.py): input frames carry the time they were
+# sampled and the receiver is pinged once a second to line up the clocks.
+SEND_TIMESTAMPS = True
+INPUT_TYPES = ("full_state", "gamepad", "gyro", "batch")
+clock_sync = protocol.ClockSync()
+
+# The last receiver we connected to and the config it gave us, tried first
+# on the next launch (CACHE_TIMEOUT to answer) before asking or scanning.
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "server_cache.json")
+CACHE_TIMEOUT = 0.3
+received_config = {}
+config_version = 0   # bumped when the receiver pushes a new config
+saved_cache = {}
+
+# Names this deck to receivers, which then keep its virtual pad through a
+# reconnect; generated once and kept in the server cache.
+CLIENT_KEY = None
+
+# Capture mode: every input frame sent is also appended, with its time, to
+# this file (see capture.py); replay it later with replay.py.
+CAPTURE_PATH = None
+capture_writer = None
+
+# Input is sampled at SAMPLE_RATE_HZ (125, 250, 500 or 1000), independently
+# of the status window, which only redraws when its text changes.
+SAMPLE_RATE_HZ = 250
+JOY_EVENTS = (pygame.JOYAXISMOTION, pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP, pygame.JOYHATMOTION)
+
+# Keep receiving controller input while the window is unfocused or hidden.
+os.environ.setdefault("SDL_JOYSTICK_ALLOW_BACKGROUND_EVENTS", "1")
+
+# Status display: "window" (a full-size status window), "minimal" (a small
+# one) or "headless" (no window, status goes to the console). Also set with
+# --minimal / --headless, e.g. from Steam's launch options.
+RENDER_MODE = "window"
+for _arg in sys.argv[1:]:
+    if _arg in ("--window", "--minimal", "--headless"):
+        RENDER_MODE = _arg[2:]
+if RENDER_MODE == "headless":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+WINDOW_SIZES = {"window": (1280, 800), "minimal": (480, 60), "headless": (1, 1)}
+BACKGROUND = (20, 20, 20)
+STATUS_POS = (20, 20)
+status_text = None
+status_rect = None
 
 pygame.init()
 pygame.display.set_caption("Input Sender")
-screen = pygame.display.set_mode((1280, 800))
+screen = pygame.display.set_mode(WINDOW_SIZES.get(RENDER_MODE, WINDOW_SIZES["window"]))
+screen.fill(BACKGROUND)
+pygame.display.flip()
 font = pygame.font.SysFont("monospace", 20)
-clock = pygame.time.Clock()
 
 
-def fetch_config_from_receiver():
-    global SEND_FULL_STATE
+def apply_config(config):
+    # The receiver's config, from its welcome or a later push (or from the
+    # cache until we're connected). The sync mode follows in follow_sync_mode().
+    global SEND_FULL_STATE, KEYFRAME_INTERVAL_MS, DEBUG, received_config
+    received_config = config
+    SEND_FULL_STATE = config.get("SEND_FULL_STATE", False)
+    KEYFRAME_INTERVAL_MS = config.get("KEYFRAME_INTERVAL_MS", KEYFRAME_INTERVAL_MS)
+    DEBUG = config.get("DEBUG", DEBUG)
+
+
+def handle_config(config):
+    # A config pushed while connected; the main loop picks it up through
+    # config_version.
+    global config_version
+    apply_config(config)
+    config_version += 1
+    print(f"📡 Receiver config changed: FullState={SEND_FULL_STATE} Sync={config.get('SYNC_MODE')}")
+
+
+def load_cache():
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((SERVER_IP, CONFIG_PORT))
-            data = s.recv(1024)
-            config = json.loads(data.decode())
-
-            SEND_FULL_STATE = config.get("SEND_FULL_STATE", False)
-            DEBUG = config.get("DEBUG", False)
-            print(f"📡 Got config: FullState={SEND_FULL_STATE}")
-    except Exception as e:
-        print("❌ Could not get config from receiver:", e)
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache():
+    global saved_cache
+    cache = {"ip": SERVER_IP, "port": SERVER_PORT, "client_key": get_client_key(),
+             "codec": codec, "transport": transport, "config": received_config}
+    if cache == saved_cache:
+        return
+    try:
+        tmp = CACHE_PATH + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp, CACHE_PATH)
+        saved_cache = cache
+    except OSError as e:
+        print("⚠️ Could not save the server cache:", e)
+
+
+def get_client_key():
+    global CLIENT_KEY
+    if not CLIENT_KEY:
+        CLIENT_KEY = load_cache().get("client_key") or uuid.uuid4().hex
+    return CLIENT_KEY
+
+
+def try_cached_server():
+    # Connects to the receiver from the last session, if it still accepts
+    # connections, and returns the socket. Its cached config stands in only
+    # if the welcome doesn't bring one.
+    global SERVER_IP, SERVER_PORT
+    cache = load_cache()
+    ip = cache.get("ip")
+    if not ip:
+        return None
+    port = cache.get("port", SERVER_PORT)
+    previous = SERVER_IP, SERVER_PORT
+    SERVER_IP, SERVER_PORT = ip, port
+    try:
+        sock = open_connection(CACHE_TIMEOUT)
+    except (socket.error, ConnectionError):
+        print(f"💤 Cached receiver {ip}:{port} did not answer")
+        SERVER_IP, SERVER_PORT = previous
+        return None
+    if not received_config:
+        apply_config(cache.get("config") or {})
+    print(f"⚡ Using cached receiver {ip}:{port}")
+    return sock
 
 
 def get_local_networks():
+    # Directly attached IPv4 networks with their real prefix lengths, from
+    # the kernel routing table; networks larger than SCAN_MIN_PREFIX are cut
+    # down to the block around our own address.
     networks = []
+    try:
+        with open("/proc/net/route") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                iface, dest, gateway, mask = fields[0], fields[1], fields[2], fields[7]
+                if iface == "lo" or int(gateway, 16) or not int(dest, 16):
+                    continue
+                dest = socket.inet_ntoa(struct.pack("<I", int(dest, 16)))
+                prefix = bin(int(mask, 16)).count("1")
+                network = ipaddress.IPv4Network(f"{dest}/{prefix}", strict=False)
+                if network.prefixlen < SCAN_MIN_PREFIX:
+                    try:
+                        own_ip = interface_address(iface)
+                    except OSError:
+                        continue
+                    network = ipaddress.IPv4Network(f"{own_ip}/{SCAN_MIN_PREFIX}", strict=False)
+                if network not in networks and not network.is_loopback:
+                    networks.append(network)
+    except (OSError, ValueError, IndexError, StopIteration) as e:
+        print(f"Could not read the routing table: {e}")
+    if networks:
+        return networks
+
     try:
         hostname = socket.gethostname()
         local_ips = socket.getaddrinfo(hostname, None, socket.AF_INET)
@@ -61,55 +233,127 @@ def get_local_networks():
     return networks
 
 
-def check_server_at_ip(ip):
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(SCAN_TIMEOUT)
-        result = sock.connect_ex((str(ip), SERVER_PORT))
-        sock.close()
-        return str(ip) if result == 0 else None
-    except:
-        return None
+def interface_address(iface):
+    import fcntl
+    SIOCGIFADDR = 0x8915
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", iface[:15].encode()))
+    return socket.inet_ntoa(packed[20:24])
 
 
-def scan_network_range(network, progress_callback=None):
-    print(f"🔍 Scanning {network}...")
-    host_ips = [ip for ip in network.hosts()]
-    total_ips = len(host_ips)
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        futures = {executor.submit(check_server_at_ip, ip): ip for ip in host_ips}
-        completed = 0
-        for future in futures:
-            completed += 1
+def arp_neighbours():
+    # Hosts the kernel already resolved (flags 0x2), i.e. machines that are
+    # up and recently talked to us: the likeliest place for a receiver.
+    neighbours = []
+    try:
+        with open("/proc/net/arp") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3 and int(fields[2], 16) & 0x2:
+                    neighbours.append(fields[0])
+    except (OSError, ValueError, StopIteration):
+        pass
+    return neighbours
+
+
+def scan_order(networks):
+    # ARP neighbours first, then every other host of each network.
+    hosts = []
+    seen = set()
+    for ip in arp_neighbours() + [str(ip) for network in networks for ip in network.hosts()]:
+        if ip not in seen:
+            seen.add(ip)
+            hosts.append(ip)
+    return hosts
+
+
+def scan_hosts(hosts, progress_callback=None):
+    # Non-blocking connects to SERVER_PORT on one selector, SCAN_PARALLEL in
+    # flight at a time. Results are taken as they complete, and the first
+    # host that accepts ends the sweep and drops every pending connect.
+    sel = selectors.DefaultSelector()
+    queue = iter(hosts)
+    total = len(hosts)
+    completed = 0
+    try:
+        while True:
+            now = time.monotonic()
+            while len(sel.get_map()) < SCAN_PARALLEL:
+                ip = next(queue, None)
+                if ip is None:
+                    break
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                err = sock.connect_ex((ip, SERVER_PORT))
+                if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    sel.register(sock, selectors.EVENT_WRITE, (ip, now + SCAN_TIMEOUT))
+                else:
+                    sock.close()
+                    completed += 1
+            if not sel.get_map():
+                return None
+
+            deadline = min(key.data[1] for key in sel.get_map().values())
+            for key, _ in sel.select(max(0.0, deadline - now)):
+                sock = key.fileobj
+                ip = key.data[0]
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                sel.unregister(sock)
+                sock.close()
+                completed += 1
+                if err == 0:
+                    print(f"✅ Found server at {ip}!")
+                    return ip
+            now = time.monotonic()
+            for key in list(sel.get_map().values()):
+                if key.data[1] <= now:
+                    sel.unregister(key.fileobj)
+                    key.fileobj.close()
+                    completed += 1
             if progress_callback:
-                progress_callback(completed, total_ips, str(futures[future]))
-            result = future.result()
-            if result:
-                print(f"✅ Found server at {result}!")
-                return result
-    return None
+                progress_callback(completed, total)
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+
+
+def discover_server(networks):
+    # One broadcast/multicast round trip finds every receiver that answers
+    # discovery probes; the first to answer is used.
+    global SERVER_PORT
+    receivers = discovery.discover([str(n.broadcast_address) for n in networks])
+    for r in receivers:
+        print(f"📡 Found receiver {r.get('name', '?')} ({r.get('os', '?')}) at {r['ip']}:{r.get('port')}")
+    if not receivers:
+        return None
+    SERVER_PORT = receivers[0].get("port", SERVER_PORT)
+    return receivers[0]["ip"]
 
 
 def scan_for_server():
-    draw_status("Scanning LAN...")
+    draw_status("Looking for receivers...")
     networks = get_local_networks()
+    server_ip = discover_server(networks)
+    if server_ip:
+        return server_ip
 
-    for network in networks:
-        def progress_callback(completed, total, current_ip):
-            percentage = (completed / total) * 100
-            message = f"Scanning: {percentage:.0f}%"
-            draw_status(message)
-            pygame.display.flip()
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
+    # Nobody answered the probe (an older receiver, or broadcasts are
+    # filtered): fall back to sweeping the local networks.
+    draw_status("Scanning LAN...")
+    hosts = scan_order(networks)
+    print(f"🔍 Scanning {len(hosts)} hosts on {', '.join(str(n) for n in networks)}...")
 
-        server_ip = scan_network_range(network, progress_callback)
-        if server_ip:
-            return server_ip
+    def progress_callback(completed, total):
+        percentage = (completed / total) * 100
+        draw_status(f"Scanning: {percentage:.0f}%")
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
 
-    return None
+    return scan_hosts(hosts, progress_callback)
 
 
 def ask_for_ip():
@@ -125,32 +369,347 @@ def ask_for_ip():
     return 'auto' if choice == 'scan' else choice
 
 
+def open_connection(timeout=CONNECT_TIMEOUT):
+    # One attempt: connect, say hello and remember the receiver.
+    global reply_reader
+    s = socket.create_connection((SERVER_IP, SERVER_PORT), timeout=timeout)
+    try:
+        s.settimeout(None)
+        reply_reader = protocol.FrameReader()
+        negotiate(s)
+    except (socket.error, ConnectionError):
+        s.close()
+        raise
+    pygame.display.set_caption("Input Sender")
+    draw_status(f"Connected to {SERVER_IP}")
+    save_cache()
+    return s
+
+
 def connect():
+    delay = RECONNECT_DELAY
     while True:
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((SERVER_IP, SERVER_PORT))
-            return s
-        except socket.error:
+            return open_connection()
+        except (socket.error, ConnectionError):
             pygame.display.set_caption("Input Sender - Disconnected")
             draw_status("Connection error ")
-            time.sleep(RETRY_DELAY)
+            # Jittered exponential backoff: a receiver that only blinked is
+            # back within tens of ms, one that is gone is polled gently.
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, RETRY_DELAY)
+
+
+class Pipeline:
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = reply_reader
+        self.queue = deque(maxlen=SEND_QUEUE_LEN)
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.error = None
+        self.closed = False
+        threading.Thread(target=self._writer, daemon=True).start()
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def put(self, data):
+        if self.error:
+            raise ConnectionError(self.error)
+        with self.cond:
+            # The deque discards its oldest frame once full, so a stalled
+            # socket costs stale input rather than a blocked pygame loop.
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(data)
+            self.cond.notify()
+
+    def take_dropped(self):
+        # Frames dropped since the last call.
+        with self.cond:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _fail(self, reason):
+        if self.error is None and not self.closed:
+            self.error = str(reason)
+            print("⚠️ Pipeline stopped:", reason)
+        self.close()
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                data = self.queue.popleft()
+            try:
+                self.sock.sendall(data)
+            except OSError as ex:
+                self._fail(ex)
+                return
+
+    def _reader(self):
+        while not self.closed:
+            try:
+                if self.reader.recv_from(self.sock) == 0:
+                    self._fail("receiver closed the connection")
+                    return
+            except OSError as ex:
+                self._fail(ex)
+                return
+            while True:
+                line = self.reader.next_frame()
+                if line is None:
+                    break
+                if line:
+                    try:
+                        handle_reply(protocol.decode(line))
+                    except Exception as ex:
+                        print("❌ Bad reply from receiver:", ex)
+
+
+class InputSampler:
+    # Joystick state kept up to date from pygame's joystick events, so a
+    # sample only costs the events that arrived since the last one instead
+    # of a get_axis/get_button call per index. changed holds what moved
+    # since it was last cleared, keyed by (kind, index).
+    def __init__(self, joystick):
+        self.joystick = joystick
+        self.instance_id = joystick.get_instance_id()
+        self.axes = [round(joystick.get_axis(i), 2) for i in range(joystick.get_numaxes())]
+        self.buttons = [joystick.get_button(i) for i in range(joystick.get_numbuttons())]
+        self.hat = list(joystick.get_hat(0))
+        self.changed = {}
+        self.period = 1.0 / SAMPLE_RATE_HZ
+        self.due = time.monotonic()
+
+    def handle(self, event):
+        # Other pads pygame sees (Steam's virtual gamepad on a Deck) send
+        # events too; only ours count.
+        if event.instance_id != self.instance_id:
+            return
+        etype = event.type
+        if etype == pygame.JOYAXISMOTION:
+            if event.axis < len(self.axes):
+                val = round(event.value, 2)
+                if val != self.axes[event.axis]:
+                    self.axes[event.axis] = val
+                    self.changed[("AXIS", event.axis)] = val
+        elif etype == pygame.JOYHATMOTION:
+            if event.hat == 0:
+                hat = list(event.value)
+                if hat != self.hat:
+                    self.hat = hat
+                    self.changed[("HAT", 0)] = hat
+        elif event.button < len(self.buttons):
+            pressed = 1 if etype == pygame.JOYBUTTONDOWN else 0
+            if pressed != self.buttons[event.button]:
+                self.buttons[event.button] = pressed
+                self.changed[("BTN", event.button)] = pressed
+
+    def full_state(self):
+        return {'type': 'full_state',
+                'data': {'axes': list(self.axes), 'buttons': list(self.buttons), 'hat': list(self.hat)}}
+
+    def wait(self):
+        # Sleep until the next sample is due. Oversleeping by a fraction of
+        # a period is made up on the following samples, but after a real
+        # stall (a slow send, a reconnect) sampling restarts from now
+        # rather than bursting to catch up.
+        now = time.monotonic()
+        if now < self.due:
+            time.sleep(self.due - now)
+            now = time.monotonic()
+        elif now - self.due > 4 * self.period:
+            self.due = now
+        self.due += self.period
+        return now
+
+
+class HybridSync:
+    # Each frame carries every field changed since the last frame the
+    # receiver acknowledged, so a lost frame is repaired by the next one.
+    # A full_state keyframe goes out every KEYFRAME_INTERVAL_MS or as soon
+    # as the receiver asks for one.
+    def __init__(self, joystick):
+        self.axis_codes = [f"AXIS_{i}" for i in range(joystick.get_numaxes())]
+        self.button_codes = [f"BTN_{i}" for i in range(joystick.get_numbuttons())]
+        self.values = {}
+        self.changed_at = {}
+        self.seq = 0
+        self.acked = 0
+        self.keyframe_due = 0.0
+
+    def ack(self, seq):
+        if protocol.seq_newer(seq, self.acked):
+            self.acked = seq
+
+    def resync(self):
+        self.keyframe_due = 0.0
+
+    def _track(self, code, value, seq):
+        self.values[code] = value
+        self.changed_at[code] = seq
+
+    def next_frame(self, sampler):
+        axes = list(sampler.axes)
+        buttons = list(sampler.buttons)
+        hat = list(sampler.hat)
+        seq = (self.seq + 1) & protocol.SEQ_MASK
+
+        values = self.values
+        for code, val in zip(self.axis_codes, axes):
+            old = values.get(code)
+            if old is None or abs(val - old) >= 0.01:
+                self._track(code, val, seq)
+        for code, pressed in zip(self.button_codes, buttons):
+            if values.get(code) != pressed:
+                self._track(code, pressed, seq)
+        if values.get("HAT_0") != hat:
+            self._track("HAT_0", hat, seq)
+
+        now = time.monotonic()
+        if now >= self.keyframe_due:
+            self.keyframe_due = now + KEYFRAME_INTERVAL_MS / 1000.0
+            self.seq = seq
+            return {'type': 'full_state', 'seq': seq,
+                    'data': {'axes': axes, 'buttons': buttons, 'hat': hat}}
+
+        acked = self.acked
+        events = [[code, values[code]] for code, at in self.changed_at.items()
+                  if protocol.seq_newer(at, acked)]
+        if not events:
+            return None
+        self.seq = seq
+        return {'type': 'batch', 'seq': seq, 'data': {'events': events}}
+
+
+def handle_reply(message):
+    mtype = message.get("type")
+    if mtype == "ack":
+        if hybrid_sync:
+            hybrid_sync.ack(message.get("data", {}).get("seq", 0))
+    elif mtype == "resync":
+        if hybrid_sync:
+            hybrid_sync.resync()
+    elif mtype == "status":
+        server_status.update(message.get("data", {}))
+    elif mtype == "rumble":
+        if rumble_handler and rumble_enabled:
+            rumble_handler(message.get("data", {}).get("RUMBLE", 0))
+    elif mtype == "pong":
+        clock_sync.pong(message.get("data", {}), time.monotonic())
+    elif mtype == "config":
+        handle_config(message.get("data", {}))
+
+
+def negotiate(sock):
+    global codec, transport, udp_sock, udp_addr, udp_session, udp_seq, pipeline, rumble_enabled
+    codec = protocol.CODEC_JSON
+    transport = protocol.TRANSPORT_TCP
+    if pipeline is not None:
+        pipeline.close()
+        pipeline = None
+    codecs = [WIRE_CODEC] + [c for c in protocol.SUPPORTED_CODECS if c != WIRE_CODEC]
+    transports = [protocol.TRANSPORT_UDP, protocol.TRANSPORT_TCP]
+    # No motion sensors are read here, so gyro isn't offered.
+    hello = protocol.make_hello(codecs, transports=transports, ack=not PIPELINED, client=get_client_key(), rumble=True)
+    reply = send(sock, hello)
+    while reply.get("type") in protocol.PUSHED_TYPES:
+        reply = wait_reply(sock)
+    # Receivers without a handshake just ack the hello like any other line.
+    if reply.get("type") == "welcome":
+        welcome = reply.get("data", {})
+        codec = welcome.get("codec", protocol.CODEC_JSON)
+        server_status.update(CLIENT_ID=welcome.get("CLIENT_ID"), CLIENT_COUNT=welcome.get("CLIENT_COUNT"))
+        if welcome.get("resumed"):
+            print("♻️ Receiver kept our controller through the reconnect")
+        rumble_enabled = welcome.get("rumble", True)
+        if "config" in welcome:
+            apply_config(welcome["config"])
+            print(f"📡 Got config: FullState={SEND_FULL_STATE} Sync={received_config.get('SYNC_MODE')}")
+        if welcome.get("transport") == protocol.TRANSPORT_UDP:
+            if udp_sock is None:
+                udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp_addr = (SERVER_IP, welcome.get("udp_port", SERVER_PORT))
+            udp_session = welcome["session"]
+            udp_seq = 0
+            transport = protocol.TRANSPORT_UDP
+        if welcome.get("ack") is False:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pipeline = Pipeline(sock)
+    mode = "pipelined" if pipeline else "acked"
+    print(f"🤝 Using {codec} protocol over {transport} ({mode})")
+
+
+def wait_reply(sock):
+    while True:
+        line = reply_reader.next_frame()
+        if line:
+            return protocol.decode(line)
+        if line is None and reply_reader.recv_from(sock) == 0:
+            raise ConnectionError("Lost connection or no response")
 
 
 def send(sock, payload):
-    message = json.dumps(payload)
+    global udp_seq
     try:
-        sock.sendall((message + '\n').encode())
-        buffer = ""
-        while True:
-            data = sock.recv(1024).decode()
-            if not data:
-                raise ConnectionError("Lost connection or no response")
-            buffer += data
-            if '\n' in buffer:
-                line, _ = buffer.split('\n', 1)
-                return json.loads(line)
+        if pipeline and pipeline.error:
+            raise ConnectionError(pipeline.error)
+        if SEND_TIMESTAMPS and payload.get('type') in INPUT_TYPES:
+            payload['ts'] = time.monotonic()
+        # Each frame is encoded once; a capture records the same bytes.
+        capturing = capture_writer and payload.get('type') in INPUT_TYPES
+        if transport == protocol.TRANSPORT_UDP:
+            frame = protocol.encode_frame(payload, codec)
+            datagram = protocol.frame_datagram(udp_session, udp_seq + 1, frame)
+            if capturing:
+                capture_writer.write(protocol.frame_stream(frame, codec), codec)
+            udp_seq += 1
+            udp_sock.sendto(datagram, udp_addr)
+            return {}
+        frame = protocol.encode(payload, codec)
+        if capturing:
+            capture_writer.write(frame, codec)
+        if pipeline:
+            pipeline.put(frame)
+            return {}
+        sock.sendall(frame)
+        reply = wait_reply(sock)
+        if "config" in reply:
+            # Acked clients get config changes with their next reply.
+            handle_config(reply["config"])
+        return reply
+
+    except ValueError as ex:
+        # Too big for the wire (a long debug line, say): dropped, the
+        # connection is fine.
+        print(f"⚠️ Frame not sent: {ex}")
+        return {}
+    except socket.error:
+        raise ConnectionError("Lost connection")
 
+
+def probe(sock):
+    # Pings always use the TCP connection, also when input goes over UDP.
+    ping = protocol.encode(clock_sync.ping(time.monotonic()), codec)
+    try:
+        if pipeline:
+            pipeline.put(ping)
+            return
+        sock.sendall(ping)
+        # Lines the receiver pushed ahead of the pong are handled on the way.
+        reply = wait_reply(sock)
+        while reply.get("type") in protocol.PUSHED_TYPES and reply.get("type") != "pong":
+            handle_reply(reply)
+            reply = wait_reply(sock)
+        handle_reply(reply)
     except socket.error:
         raise ConnectionError("Lost connection")
 
@@ -161,15 +720,49 @@ def debug_log(sock, text):
 
 
 def draw_status(message):
-    screen.fill((20, 20, 20))
-    label = font.render(message, True, (200, 200, 200))
-    screen.blit(label, (20, 35))
-    pygame.display.flip()
+    # Only the status line is redrawn, and only when its text changes.
+    global status_text, status_rect
+    if message == status_text:
+        return
+    status_text = message
+    if RENDER_MODE == "headless":
+        if message:
+            print("ℹ️", message)
+        return
+    dirty = []
+    if status_rect:
+        screen.fill(BACKGROUND, status_rect)
+        dirty.append(status_rect)
+    status_rect = screen.blit(font.render(message, True, (200, 200, 200)), STATUS_POS)
+    dirty.append(status_rect)
+    pygame.display.update(dirty)
+
+
+def follow_sync_mode(joystick):
+    # The receiver's SYNC_MODE wins, then ours, then SEND_FULL_STATE; checked
+    # after every connect and config change.
+    global sync_mode, hybrid_sync
+    mode = received_config.get("SYNC_MODE") or SYNC_MODE or (
+        protocol.SYNC_FULL if SEND_FULL_STATE else protocol.SYNC_DELTA)
+    if mode == protocol.SYNC_DELTA and transport == protocol.TRANSPORT_UDP:
+        # The receiver drops late datagrams, and a delta is the only copy of
+        # its change; hybrid frames repeat every change until it's acked.
+        mode = protocol.SYNC_HYBRID
+    if mode == sync_mode:
+        return False
+    if sync_mode:
+        print(f"🔁 Switching from {sync_mode} to {mode} sync")
+    sync_mode = mode
+    hybrid_sync = HybridSync(joystick) if mode == protocol.SYNC_HYBRID else None
+    return True
 
 
 def main():
-    global SERVER_IP
+    global SERVER_IP, rumble_handler, capture_writer
 
+    sock = None
+    if not SERVER_IP or SERVER_IP.lower() == "auto":
+        sock = try_cached_server()
     if not SERVER_IP or SERVER_IP.lower() == "auto":
         user_input = ask_for_ip() if not SERVER_IP else SERVER_IP
         SERVER_IP = scan_for_server() if user_input.lower() == 'auto' else user_input
@@ -177,7 +770,9 @@ def main():
             print("❌ No server found on LAN")
             sys.exit(1)
 
-    fetch_config_from_receiver()
+    if CAPTURE_PATH:
+        capture_writer = capture.CaptureWriter(CAPTURE_PATH)
+        print(f"⏺️ Capturing frames to {CAPTURE_PATH}")
 
     pygame.joystick.init()
     while pygame.joystick.get_count() == 0:
@@ -188,86 +783,97 @@ def main():
 
     joystick = pygame.joystick.Joystick(0)
     joystick.init()
-
-    axes_state = [0.0] * joystick.get_numaxes()
-    buttons_state = [False] * joystick.get_numbuttons()
-    hat_state = (0, 0)
-
-    sock = connect()
+    rumble_handler = lambda strength: joystick.rumble(strength, strength, 200)
+
+    sampler = InputSampler(joystick)
+    # Only what the loop consumes is queued, so a busy window (mouse,
+    # touch, resizes) doesn't cost anything per sample.
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed((pygame.QUIT, pygame.VIDEOEXPOSE) + JOY_EVENTS)
+    full_due = 0.0
+    # The receiver's pad starts at rest, not at our starting values (the
+    # Deck's triggers rest at -1.0, buttons may be held at launch): the
+    # first sample carries the complete state in every mode.
+    resend_full = True
+
+    if sock is None:
+        sock = connect()
+    follow_sync_mode(joystick)
+    seen_config = config_version
 
     while True:
         try:
-            pygame.event.pump()
+            now = sampler.wait()
+
+            if pipeline and pipeline.take_dropped() and not hybrid_sync:
+                # A stalled socket dropped queued frames, maybe deltas that
+                # nothing else repeats: catch the receiver up with a keyframe.
+                resend_full = True
+
+            if config_version != seen_config:
+                # Pushed by the receiver; a new mode starts from a keyframe.
+                seen_config = config_version
+                save_cache()
+                if follow_sync_mode(joystick) and not hybrid_sync:
+                    resend_full = True
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sock.close()
+                    if capture_writer:
+                        capture_writer.close()
                     sys.exit()
-
-            if not pygame.display.get_active():
-                draw_status("Paused (unfocused)")
-                time.sleep(0.1)
-                continue
-
-            if SEND_FULL_STATE:
-                axes = [round(joystick.get_axis(i), 2) for i in range(joystick.get_numaxes())]
-                buttons = [joystick.get_button(i) for i in range(joystick.get_numbuttons())]
-                hat = list(joystick.get_hat(0))
-
+                if event.type == pygame.VIDEOEXPOSE:
+                    # Uncovered: present the last frame again, nothing to redraw.
+                    pygame.display.flip()
+                else:
+                    sampler.handle(event)
+
+            if SEND_TIMESTAMPS and clock_sync.due(now):
+                probe(sock)
+
+            if hybrid_sync:
+                sampler.changed.clear()
+                frame = hybrid_sync.next_frame(sampler)
+                if frame and send(sock, frame):
+                    # An acked reply means the receiver applied this frame.
+                    hybrid_sync.ack(frame['seq'])
+
+            elif sync_mode == protocol.SYNC_FULL or resend_full:
+                # Sent on every change, and every KEYFRAME_INTERVAL_MS while
+                # idle so the receiver still converges after a lost frame.
+                # Delta mode sends one too, right after connecting.
+                if sampler.changed or now >= full_due or resend_full:
+                    full_due = now + KEYFRAME_INTERVAL_MS / 1000.0
+                    send(sock, sampler.full_state())
+                    sampler.changed.clear()
+                    resend_full = False
+
+            elif sampler.changed:
+                # SEND (one message per sample, every change since the last)
                 send(sock, {
-                    'type': 'full_state',
+                    'type': 'batch',
                     'data': {
-                        'axes': axes,
-                        'buttons': buttons,
-                        'hat': hat
+                        'events': [[f"{event_type}_{index}", value]
+                                   for (event_type, index), value in sorted(sampler.changed.items())]
                     }
                 })
-
-            else:
-                pending_events = []
-
-                # AXES
-                for i in range(joystick.get_numaxes()):
-                    val = round(joystick.get_axis(i), 2)
-                    if abs(val - axes_state[i]) >= 0.01:
-                        axes_state[i] = val
-                        pending_events.append(("AXIS", i, val))
-
-                # BUTTONS
-                for i in range(joystick.get_numbuttons()):
-                    pressed = joystick.get_button(i)
-                    if pressed != buttons_state[i]:
-                        buttons_state[i] = pressed
-                        pending_events.append(("BTN", i, pressed))
-
-                # HAT
-                new_hat = joystick.get_hat(0)
-                if new_hat != hat_state:
-                    hat_state = new_hat
-                    pending_events.append(("HAT", 0, list(hat_state)))
-
-                pending_events.sort(key=lambda e: (e[0], e[1]))
-
-                # SEND
-                for event_type, index, value in pending_events:
-                    send(sock, {
-                        'type': 'gamepad',
-                        'data': {
-                            'code': f"{event_type}_{index}",
-                            'state': value
-                        }
-                    })
-
-            draw_status("")
-            clock.tick(60)
+                sampler.changed.clear()
 
         except (ConnectionError, BrokenPipeError):
             print("⚠️ Lost connection. Reconnecting...")
             draw_status("Disconnected, retrying...")
-            time.sleep(0.5)
             sock.close()
             sock = connect()
+            follow_sync_mode(joystick)
+            seen_config = config_version
+            # The receiver may have lost whatever was held when the link
+            # dropped: the next sample carries the complete state.
+            if hybrid_sync:
+                hybrid_sync.resync()
+            else:
+                resend_full = True
 
 
 if __name__ == "__main__":
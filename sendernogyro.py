@@ -8,10 +8,10 @@ from tkinter import simpledialog
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import ipaddress
+import protocol
 
 SERVER_IP = ""
 SERVER_PORT = 5000
-CONFIG_PORT = 5001
 RETRY_DELAY = 3
 SCAN_TIMEOUT = 1
 
@@ -25,19 +25,19 @@ font = pygame.font.SysFont("monospace", 20)
 clock = pygame.time.Clock()
 
 
-def fetch_config_from_receiver():
-    global SEND_FULL_STATE
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((SERVER_IP, CONFIG_PORT))
-            data = s.recv(1024)
-            config = json.loads(data.decode())
-
-            SEND_FULL_STATE = config.get("SEND_FULL_STATE", False)
-            DEBUG = config.get("DEBUG", False)
-            print(f"📡 Got config: FullState={SEND_FULL_STATE}")
-    except Exception as e:
-        print("❌ Could not get config from receiver:", e)
+def apply_config(config):
+    global SEND_FULL_STATE, DEBUG
+    SEND_FULL_STATE = config.get("SEND_FULL_STATE", False)
+    DEBUG = config.get("DEBUG", False)
+    print(f"📡 Got config: FullState={SEND_FULL_STATE}")
+
+
+def negotiate(sock):
+    # Plain JSON and acked; the receiver's config comes with its welcome and
+    # later changes with the reply to the next message.
+    reply = send(sock, protocol.make_hello([protocol.CODEC_JSON]))
+    if reply.get("type") == "welcome" and "config" in reply.get("data", {}):
+        apply_config(reply["data"]["config"])
 
 
 def get_local_networks():
@@ -130,6 +130,7 @@ def connect():
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.connect((SERVER_IP, SERVER_PORT))
+            negotiate(s)
             return s
         except socket.error:
             pygame.display.set_caption("Input Sender - Disconnected")
@@ -149,7 +150,10 @@ def send(sock, payload):
             buffer += data
             if '\n' in buffer:
                 line, _ = buffer.split('\n', 1)
-                return json.loads(line)
+                reply = json.loads(line)
+                if "config" in reply:
+                    apply_config(reply["config"])
+                return reply
 
     except socket.error:
         raise ConnectionError("Lost connection")
@@ -177,8 +181,6 @@ def main():
             print("❌ No server found on LAN")
             sys.exit(1)
 
-    fetch_config_from_receiver()
-
     pygame.joystick.init()
     while pygame.joystick.get_count() == 0:
         draw_status("🕹️ Waiting for controller...")
@@ -0,0 +1,378 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import devicepool
+import discovery
+import metrics
+import protocol
+import ringlog
+
+log = logging.getLogger(ringlog.LOGGER_NAME)
+
+# -----------------------
+# Receiver sessions
+# -----------------------
+# The parts of a receiver that linux.py and windows.py share: the table of
+# connected decks, the hello/welcome handshake, config.json and its live
+# reload, the lines pushed to decks (status, config, pongs, sync acks) and
+# the discovery responder. Each receiver builds one Receiver around its
+# device functions and keeps its own device code, socket loops and UI.
+CONFIG_POLL_INTERVAL = 1.0   # seconds between checks for config.json edits
+
+# config.json keys and their values when a key is missing. LOG_LEVEL None
+# means DEBUG when DEBUG is set, else INFO.
+CONFIG_DEFAULTS = {
+    "USE_UDP": False,
+    "USE_RUMBLE": False,
+    "SEND_FULL_STATE": False,
+    "SYNC_MODE": None,
+    "KEYFRAME_INTERVAL_MS": 500,
+    "SERVER_MODE": "threads",   # linux.py: "threads", one thread per client, or "selectors", one event loop
+    "DEVICE_POOL_SIZE": 1,      # virtual pads created ahead of time (see devicepool.py)
+    "RESUME_GRACE_S": 30.0,     # seconds a disconnected deck's pad waits for it to come back
+    "DEBUG": False,
+    "LOG_LEVEL": None,
+}
+# These pick the sockets and threads, so they only change on a restart.
+RESTART_ONLY = ("USE_UDP", "SERVER_MODE")
+
+
+class Session:
+    # One connected deck. Receivers subclass it for their own counters.
+    def __init__(self, client_id, conn, addr):
+        self.client_id = client_id
+        self.conn = conn
+        self.addr = addr
+        self.device = None
+        self.key = None
+        self.codec = protocol.CODEC_JSON
+        self.transport = protocol.TRANSPORT_TCP
+        self.udp_token = None
+        self.last_seq = None
+        self.stale_drops = 0
+        self.reader = protocol.FrameReader()
+        self.ack = True
+        self.gyro = False
+        self.rumble = False
+        self.pending_config = None
+        self.sync = protocol.SyncTracker()
+        self.metrics = metrics.LatencyMetrics()
+        self.send_lock = threading.Lock()
+
+    def send(self, payload):
+        # Replies come from the handler thread, acks for UDP input from the
+        # UDP thread, and pushes from whichever thread saw a deck join or
+        # leave or the config change.
+        with self.send_lock:
+            self.conn.sendall(protocol.encode_reply(payload))
+
+
+class Receiver:
+    # gyro and rumble say what the devices can do: gyro whether they take
+    # motion input, rumble whether rumble is forwarded back to decks.
+    def __init__(self, name, create, reset, destroy, port=5000, gyro=False, rumble=False, config_path="config.json"):
+        self.name = name
+        self.port = port
+        self.gyro = gyro
+        self.rumble = rumble
+        self.config_path = config_path
+        self.config = dict(CONFIG_DEFAULTS)
+        self.config_mtime = None
+        self.clients = {}
+        self.udp_sessions = {}
+        self.lock = threading.Lock()
+        self.next_client_id = 1
+        self.load_config()
+        self.pool = devicepool.DevicePool(create, reset, destroy,
+                                          self.config["DEVICE_POOL_SIZE"], self.config["RESUME_GRACE_S"])
+
+    # -----------------------
+    # Config
+    # -----------------------
+    def load_config(self, reload=False):
+        # Reads config.json into self.config, at startup and again from
+        # watch_config() whenever the file changes.
+        if not os.path.exists(self.config_path):
+            return False
+        try:
+            self.config_mtime = os.stat(self.config_path).st_mtime
+            with open(self.config_path, "r") as f:
+                cfg = json.load(f)
+            config = {key: cfg.get(key, default) for key, default in CONFIG_DEFAULTS.items()}
+            config["LOG_LEVEL"] = config["LOG_LEVEL"] or ("DEBUG" if config["DEBUG"] else "INFO")
+            if reload:
+                changed = [key for key in RESTART_ONLY if config[key] != self.config[key]]
+                if changed:
+                    log.warning("⚠️ %s changed in %s, restart the receiver to apply", "/".join(changed), self.config_path)
+                for key in RESTART_ONLY:
+                    config[key] = self.config[key]
+            self.config = config
+            ringlog.set_level(config["LOG_LEVEL"])
+            log.info("🛠️ %s config: Rumble=%s, FullState=%s, Sync=%s, Debug=%s, LogLevel=%s",
+                     "Reloaded" if reload else "Loaded", config["USE_RUMBLE"], config["SEND_FULL_STATE"],
+                     config["SYNC_MODE"], config["DEBUG"], config["LOG_LEVEL"])
+            return True
+        except Exception as ex:
+            log.error("❌ Error reading config: %s", ex)
+            return False
+
+    def client_config(self):
+        # The part of the config senders follow: sent in every welcome and
+        # again whenever config.json changes.
+        config = self.config
+        return {
+            "SEND_FULL_STATE": config["SEND_FULL_STATE"],
+            "SYNC_MODE": config["SYNC_MODE"],
+            "KEYFRAME_INTERVAL_MS": config["KEYFRAME_INTERVAL_MS"],
+            "RUMBLE": config["USE_RUMBLE"],
+            "DEBUG": config["DEBUG"],
+        }
+
+    def watch_config(self):
+        # Applies config.json edits without a restart and sends the new
+        # config to every connected deck.
+        while True:
+            time.sleep(CONFIG_POLL_INTERVAL)
+            try:
+                mtime = os.stat(self.config_path).st_mtime
+            except OSError:
+                continue
+            if mtime == self.config_mtime or not self.load_config(reload=True):
+                continue
+            self.pool.size = self.config["DEVICE_POOL_SIZE"]
+            self.pool.grace = self.config["RESUME_GRACE_S"]
+            try:
+                self.pool.fill()
+            except Exception as ex:
+                log.error("❌ Could not pre-create virtual devices: %s", ex)
+            self.push_config()
+
+    # -----------------------
+    # Clients
+    # -----------------------
+    def accept(self, conn, addr, session_class=Session):
+        # Clients that skip the hello keep what the devices support.
+        with self.lock:
+            client_id = self.next_client_id
+            self.next_client_id += 1
+            session = session_class(client_id, conn, addr)
+            session.gyro = self.gyro
+            self.clients[client_id] = session
+            count = len(self.clients)
+        log.info("✅ New connection from %s assigned Client ID #%d. Total clients: %d", addr, client_id, count)
+        self.push_status()
+        return session
+
+    def close(self, session):
+        with self.lock:
+            self.clients.pop(session.client_id, None)
+            self.udp_sessions.pop(session.udp_token, None)
+            count = len(self.clients)
+        try:
+            session.conn.close()
+        except Exception:
+            pass
+        if session.device is not None:
+            try:
+                self.pool.release(session.device, session.key)
+            except Exception as ex:
+                log.error("❌ Could not release the device of client #%d: %s", session.client_id, ex)
+        log.info("📴 Client #%d disconnected. Connected clients: %d", session.client_id, count)
+        self.push_status()
+
+    def client_count(self):
+        with self.lock:
+            return len(self.clients)
+
+    def open_client(self, session, key=None):
+        # Gives the client its device: the one this deck (same key) still
+        # holds on a connection that hasn't noticed it's dead yet, or left
+        # parked in the pool, else a pooled or new one. Returns True when it
+        # resumed the deck's previous device.
+        old = None
+        device = None
+        resumed = False
+        if key is not None:
+            with self.lock:
+                old = next((s for s in self.clients.values() if s is not session and s.key == key), None)
+                if old is not None:
+                    device, old.device, old.key = old.device, None, None
+                    # Its datagrams would reach a session without a device.
+                    self.udp_sessions.pop(old.udp_token, None)
+            if old is not None:
+                log.info("♻️ Client #%d replaces client #%d (same deck)", session.client_id, old.client_id)
+                try:
+                    old.conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if device is None:
+            device, resumed = self.pool.acquire(key)
+        else:
+            resumed = True
+        if session.device is not None:
+            self.pool.release(session.device)
+        session.device = device
+        session.key = key
+        log.info("🔌 Client #%d %s for %s", session.client_id,
+                 "resumed its device" if resumed else "got a device", session.addr)
+        return resumed
+
+    def negotiate(self, session, hello, **extra):
+        # Answers a hello; extra fields go into the welcome as they are.
+        version, codec = protocol.negotiate(hello)
+        if version is None:
+            log.warning("⚠️ Client #%d offered no supported protocol version, staying on JSON", session.client_id)
+            version, codec = protocol.PROTOCOL_VERSION, protocol.CODEC_JSON
+        # Pushes from other threads (a deck joining or leaving, this one
+        # taking over its old connection, a config change) wait until the
+        # welcome is out: a deck takes any other first line for a receiver
+        # without a handshake.
+        with session.send_lock:
+            transport = protocol.pick_transport(hello, self.config["USE_UDP"])
+            with self.lock:
+                self.udp_sessions.pop(session.udp_token, None)
+                session.udp_token = None
+                if transport == protocol.TRANSPORT_UDP:
+                    token = random.getrandbits(32)
+                    while token in self.udp_sessions:
+                        token = random.getrandbits(32)
+                    session.udp_token = token
+                    session.last_seq = None
+                    self.udp_sessions[token] = session
+                    extra.update(session=token, udp_port=self.port)
+            session.codec = codec
+            session.reader.codec = codec
+            session.transport = transport
+            session.ack = bool(hello.get('ack', True))
+            session.sync = protocol.SyncTracker()
+            session.gyro, session.rumble = protocol.pick_capabilities(hello, self.gyro,
+                                                                      self.rumble and self.config["USE_RUMBLE"])
+            session.pending_config = None
+            resumed = self.open_client(session, hello.get('client'))
+            welcome = protocol.make_welcome(version, codec, transport=transport, ack=session.ack, resumed=resumed,
+                                            gyro=session.gyro, rumble=session.rumble, config=self.client_config(),
+                                            CLIENT_ID=session.client_id, CLIENT_COUNT=self.client_count(), **extra)
+            session.conn.sendall(protocol.encode_reply(welcome))
+        mode = "acked" if session.ack else "pipelined"
+        log.info("🤝 Client #%d negotiated protocol v%s (%s over %s, %s, gyro=%s, rumble=%s)", session.client_id,
+                 version, codec, transport, mode, session.gyro, session.rumble)
+
+    # -----------------------
+    # Replies and pushes
+    # -----------------------
+    def reply(self, session, **fields):
+        # The one reply an acked client reads per frame; a config change
+        # waiting for it rides along.
+        response = dict(fields, CLIENT_ID=session.client_id, CLIENT_COUNT=self.client_count())
+        if session.pending_config is not None:
+            response["config"], session.pending_config = session.pending_config, None
+        session.send(response)
+
+    def push_status(self):
+        with self.lock:
+            client_count = len(self.clients)
+            targets = [s for s in self.clients.values() if not s.ack]
+        for session in targets:
+            try:
+                session.send(protocol.make_status(CLIENT_ID=session.client_id, CLIENT_COUNT=client_count))
+            except Exception as ex:
+                log.debug("❌ Error pushing status to client #%d: %s", session.client_id, ex)
+
+    def push_config(self):
+        # Acked clients read exactly one reply per frame, so theirs rides on
+        # the next reply; pipelined ones get a "config" line now.
+        config = self.client_config()
+        with self.lock:
+            sessions = list(self.clients.values())
+        for session in sessions:
+            if session.ack:
+                session.pending_config = config
+                continue
+            try:
+                session.send(protocol.make_config(config))
+            except Exception as ex:
+                log.debug("❌ Error pushing config to client #%d: %s", session.client_id, ex)
+        if sessions:
+            log.info("📡 Sent the new config to %d client(s)", len(sessions))
+
+    def answer_ping(self, session, event):
+        # Clock probe from the deck: carries its last round trip and clock
+        # offset estimate, and is answered right away with our clock.
+        data = event.get('data', {})
+        session.metrics.probe(data.get('rtt'), data.get('offset'))
+        session.send(protocol.make_pong(data, time.monotonic()))
+
+    def track_sync(self, session, event, applied=True):
+        # Hybrid sync acks and resync requests; acked clients read exactly
+        # one reply per frame, so they only get them in pipelined mode.
+        seq = event.get('seq')
+        if seq is None or session.ack:
+            return
+        for reply in session.sync.frame(seq, time.monotonic(), applied):
+            if reply['type'] == 'resync':
+                log.info("⚠️ Client #%d skipped to frame #%d, requesting keyframe", session.client_id, seq)
+            session.send(reply)
+
+    # -----------------------
+    # UDP input
+    # -----------------------
+    def datagram(self, data):
+        # Returns (session, event) for a datagram to apply, or None.
+        try:
+            token, seq, frame = protocol.decode_datagram(data)
+        except ValueError:
+            return None
+        with self.lock:
+            session = self.udp_sessions.get(token)
+        if session is None or session.device is None:
+            return None
+        # Late or duplicated datagrams carry older input than what is applied already.
+        if not protocol.seq_newer(seq, session.last_seq):
+            session.stale_drops += 1
+            log.debug("[CLIENT %d] dropped stale datagram #%d (last #%d)", session.client_id, seq, session.last_seq)
+            return None
+        session.last_seq = seq
+        try:
+            event = protocol.decode(frame, session.codec)
+        except Exception as ex:
+            log.warning("❌ Client #%d %s datagram decode error: %s", session.client_id, session.codec, ex)
+            return None
+        if not isinstance(event, dict):
+            log.warning("❌ Client #%d sent a datagram that isn't an object", session.client_id)
+            return None
+        return session, event
+
+    # -----------------------
+    # Discovery
+    # -----------------------
+    def discovery_info(self):
+        config = self.config
+        return {
+            "name": socket.gethostname(),
+            "os": self.name,
+            "port": self.port,
+            "transports": [protocol.TRANSPORT_UDP, protocol.TRANSPORT_TCP] if config["USE_UDP"] else [protocol.TRANSPORT_TCP],
+            "gyro": self.gyro,
+            "rumble": self.rumble and config["USE_RUMBLE"],
+            "clients": self.client_count(),
+        }
+
+    def serve_discovery(self, interface_ip="0.0.0.0"):
+        try:
+            sock = discovery.open_responder(interface_ip)
+        except OSError as ex:
+            log.error("❌ Discovery responder unavailable: %s", ex)
+            return
+        log.info("🔎 Answering discovery probes on port %d", discovery.DISCOVERY_PORT)
+        while True:
+            try:
+                addr = discovery.answer(sock, self.discovery_info)
+                if addr:
+                    log.debug("🔎 Answered discovery probe from %s", addr[0])
+            except Exception as ex:
+                log.error("❌ Discovery error: %s", ex)
@@ -8,6 +8,9 @@ from tkinter import simpledialog
 from concurrent.futures import ThreadPoolExecutor
 import ipaddress
 import ctypes
+import os
+import protocol
+import discovery
 
 # =========================================================
 # WINDOWS SOCKET POPUP SUPPRESSION
@@ -17,7 +20,6 @@ if sys.platform.startswith("win"):
 
 SERVER_IP = ""
 SERVER_PORT = 5000
-CONFIG_PORT = 5001
 RETRY_DELAY = 3
 SCAN_TIMEOUT = 0.4
 
@@ -25,6 +27,18 @@ USE_RUMBLE = False
 SEND_FULL_STATE = True
 DEBUG = True
 
+# Status display: "window", "minimal" (a small window) or "headless" (no
+# window, status goes to the console). Also set with --minimal / --headless.
+RENDER_MODE = "window"
+for _arg in sys.argv[1:]:
+    if _arg in ("--window", "--minimal", "--headless"):
+        RENDER_MODE = _arg[2:]
+WINDOW_SIZES = {"window": (1280, 800), "minimal": (480, 60), "headless": (1, 1)}
+BACKGROUND = (20, 20, 20)
+STATUS_POS = (20, 20)
+status_text = None
+status_rect = None
+
 # =========================================================
 # TKINTER MUST INIT BEFORE PYGAME ON WINDOWS
 # =========================================================
@@ -34,29 +48,38 @@ root.withdraw()
 # =========================================================
 # PYGAME INIT
 # =========================================================
+# Keep receiving controller input while the window is unfocused or hidden.
+os.environ.setdefault("SDL_JOYSTICK_ALLOW_BACKGROUND_EVENTS", "1")
+if RENDER_MODE == "headless":
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
 pygame.init()
 pygame.display.set_caption("Input Sender")
-screen = pygame.display.set_mode((1280, 800))
+screen = pygame.display.set_mode(WINDOW_SIZES.get(RENDER_MODE, WINDOW_SIZES["window"]))
+screen.fill(BACKGROUND)
+pygame.display.flip()
 font = pygame.font.SysFont("monospace", 20)
 clock = pygame.time.Clock()
 
 
 # =========================================================
-# CONFIG FETCHING
+# CONFIG (sent with the receiver's welcome, and again on changes)
 # =========================================================
-def fetch_config_from_receiver():
+def apply_config(config):
     global USE_RUMBLE, SEND_FULL_STATE, DEBUG
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((SERVER_IP, CONFIG_PORT))
-            data = s.recv(1024)
-            config = json.loads(data.decode())
-            #USE_RUMBLE = config.get("RUMBLE", False)
-            SEND_FULL_STATE = config.get("SEND_FULL_STATE", False)
-            DEBUG = config.get("DEBUG", False)
-            print(f"Config fetched: rumble={USE_RUMBLE} full_state={SEND_FULL_STATE}")
-    except Exception as e:
-        print("Could not retrieve config:", e)
+    #USE_RUMBLE = config.get("RUMBLE", False)
+    SEND_FULL_STATE = config.get("SEND_FULL_STATE", False)
+    DEBUG = config.get("DEBUG", False)
+    print(f"Config from receiver: rumble={USE_RUMBLE} full_state={SEND_FULL_STATE}")
+
+
+def negotiate(sock):
+    # JSON and acked: every message gets exactly one reply line, and config
+    # changes arrive in those replies.
+    reply = send(sock, protocol.make_hello([protocol.CODEC_JSON], rumble=USE_RUMBLE))
+    if reply.get("type") == "welcome":
+        welcome = reply.get("data", {})
+        if "config" in welcome:
+            apply_config(welcome["config"])
 
 
 # =========================================================
@@ -113,16 +136,24 @@ def scan_network_range(network, progress_callback=None):
 
 
 def scan_for_server():
-    draw_status("Scanning LAN...")
-    pygame.display.flip()
+    global SERVER_PORT
+    draw_status("Looking for receivers...")
     networks = get_local_networks()
 
+    # Receivers answer a broadcast probe; the sweep is only the fallback.
+    receivers = discovery.discover([str(n.broadcast_address) for n in networks])
+    for r in receivers:
+        print(f"Receiver {r.get('name', '?')} at {r['ip']}:{r.get('port')}")
+    if receivers:
+        SERVER_PORT = receivers[0].get("port", SERVER_PORT)
+        return receivers[0]["ip"]
+
+    draw_status("Scanning LAN...")
     for network in networks:
 
         def progress(c, t, ip):
             pct = (c / t) * 100
             draw_status(f"Scanning {ip}  {pct:.0f}%")
-            pygame.display.flip()
 
         found = scan_network_range(network, progress)
         if found:
@@ -149,6 +180,9 @@ def connect():
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             s.connect((SERVER_IP, SERVER_PORT))
+            negotiate(s)
+            pygame.display.set_caption("Input Sender")
+            draw_status(f"Connected to {SERVER_IP}")
             return s
         except:
             pygame.display.set_caption("Input Sender - Disconnected")
@@ -168,7 +202,10 @@ def send(sock, payload):
             buffer += data
             if "\n" in buffer:
                 line, _ = buffer.split("\n", 1)
-                return json.loads(line)
+                reply = json.loads(line)
+                if "config" in reply:
+                    apply_config(reply["config"])
+                return reply
     except:
         raise ConnectionError("Lost connection")
 
@@ -179,10 +216,22 @@ def debug_log(sock, text):
 
 
 def draw_status(text):
-    screen.fill((20, 20, 20))
-    label = font.render(text, True, (200, 200, 200))
-    screen.blit(label, (20, 35))
-    pygame.display.flip()
+    # Only the status line is redrawn, and only when its text changes.
+    global status_text, status_rect
+    if text == status_text:
+        return
+    status_text = text
+    if RENDER_MODE == "headless":
+        if text:
+            print(text)
+        return
+    dirty = []
+    if status_rect:
+        screen.fill(BACKGROUND, status_rect)
+        dirty.append(status_rect)
+    status_rect = screen.blit(font.render(text, True, (200, 200, 200)), STATUS_POS)
+    dirty.append(status_rect)
+    pygame.display.update(dirty)
 
 
 def rumble(sock, strength):
@@ -205,8 +254,6 @@ def main():
             print("No server found.")
             sys.exit(1)
 
-    fetch_config_from_receiver()
-
     pygame.joystick.init()
     while pygame.joystick.get_count() == 0:
         draw_status("Waiting for controller...")
@@ -237,6 +284,8 @@ def main():
                     pygame.quit()
                     sock.close()
                     sys.exit()
+                if e.type == pygame.VIDEOEXPOSE:
+                    pygame.display.flip()
 
             # -------------------------
             # SEND FULL STATE
@@ -271,37 +320,36 @@ def main():
             # SEND ONLY CHANGES
             # -------------------------
             else:
+                events = []
+
                 # Axes
                 for i in range(joystick.get_numaxes()):
                     val = round(joystick.get_axis(i), 2)
                     if abs(val - axes_state[i]) >= 0.01:
                         axes_state[i] = val
-                        send(sock, {
-                            "type": "gamepad",
-                            "data": {"code": f"AXIS_{i}", "state": val}
-                        })
+                        events.append([f"AXIS_{i}", val])
 
                 # Buttons
                 for i in range(joystick.get_numbuttons()):
                     st = joystick.get_button(i)
                     if st != buttons_state[i]:
                         buttons_state[i] = st
-                        send(sock, {
-                            "type": "gamepad",
-                            "data": {"code": f"BTN_{i}", "state": st}
-                        })
+                        events.append([f"BTN_{i}", st])
 
                 # Hat (safe mode — only read if controller HAS a hat)
                 if hat_count > 0:
                     new_hat = joystick.get_hat(0)
                     if new_hat != hat_state:
                         hat_state = new_hat
-                        send(sock, {
-                            "type": "gamepad",
-                            "data": {"code": "HAT_0", "state": list(hat_state)}
-                        })
+                        events.append(["HAT_0", list(hat_state)])
+
+                # One message carries every change of this tick
+                if events:
+                    send(sock, {
+                        "type": "batch",
+                        "data": {"events": events}
+                    })
 
-            draw_status("")
             clock.tick(60)
 
         except ConnectionError:
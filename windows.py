@@ -1,19 +1,18 @@
 import socket
-import json
 import threading
+import time
 import vgamepad as vg
+import protocol
+import ringlog
+import sessions
 
 SHOW_UI = False
 SERVER_PORT = 5000
-CONFIG_PORT = 5001
+CONFIG_PATH = "config.json"   # read and watched by sessions.Receiver
+SUMMARY_INTERVAL = 10.0   # seconds between latency summaries in the log
 
 slider_rumble = 0
-USE_RUMBLE = False
-USE_UDP = False
-SEND_FULL_STATE = False
-DEBUG = False
-
-gamepad = vg.VX360Gamepad()
+log = ringlog.setup("INFO")
 
 button_map = {
     'BTN_0': vg.XUSB_BUTTON.XUSB_GAMEPAD_A,
@@ -28,176 +27,263 @@ button_map = {
     'BTN_10': vg.XUSB_BUTTON.XUSB_GAMEPAD_RIGHT_THUMB
 }
 
-axis_state = {
-    'LS_x': 0, 'LS_y': 0,
-    'RS_x': 0, 'RS_y': 0,
-    'LT': 0, 'RT': 0
+# Dpad bits of XUSB wButtons, in the order HAT_0_* codes name them
+DPAD_BITS = {
+    'up': int(vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_UP),
+    'down': int(vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_DOWN),
+    'left': int(vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_LEFT),
+    'right': int(vg.XUSB_BUTTON.XUSB_GAMEPAD_DPAD_RIGHT),
 }
+DPAD_UP_DOWN = DPAD_BITS['up'] | DPAD_BITS['down']
+DPAD_LEFT_RIGHT = DPAD_BITS['left'] | DPAD_BITS['right']
 
-pressed_buttons = set()
+class Pad:
+    # One virtual X360 pad. Events only edit the pending XUSB report held
+    # here; commit() copies it into gamepad.report and sends it with a single
+    # update(), and skips the driver call when nothing changed since the
+    # last report that was sent.
+    def __init__(self, gamepad):
+        self.gamepad = gamepad
+        self.buttons = 0
+        self.dpad = 0
+        self.lx = self.ly = self.rx = self.ry = 0
+        self.lt = self.rt = 0
+        self.sent = None
 
-dpad_state = {
-    'up': False,
-    'down': False,
-    'left': False,
-    'right': False
-}
+    def report(self):
+        dpad = self.dpad
+        # Opposite directions held together cancel out
+        if dpad & DPAD_UP_DOWN == DPAD_UP_DOWN:
+            dpad &= ~DPAD_UP_DOWN
+        if dpad & DPAD_LEFT_RIGHT == DPAD_LEFT_RIGHT:
+            dpad &= ~DPAD_LEFT_RIGHT
+        return (self.buttons | dpad, self.lt, self.rt, self.lx, self.ly, self.rx, self.ry)
+
+    def commit(self):
+        report = self.report()
+        if report == self.sent:
+            return False
+        r = self.gamepad.report
+        (r.wButtons, r.bLeftTrigger, r.bRightTrigger,
+         r.sThumbLX, r.sThumbLY, r.sThumbRX, r.sThumbRY) = report
+        self.gamepad.update()
+        self.sent = report
+        return True
+
+    def reset(self):
+        # Let go of everything
+        self.buttons = self.dpad = 0
+        self.lx = self.ly = self.rx = self.ry = 0
+        self.lt = self.rt = 0
+        self.commit()
+
+    def close(self):
+        # Released before the pad is unplugged, then drop the last
+        # reference so vgamepad removes the ViGEm target.
+        try:
+            self.reset()
+        finally:
+            self.gamepad = None
+
+# No motion input on an X360 pad, so gyro is never offered.
+server = sessions.Receiver("windows", lambda: Pad(vg.VX360Gamepad()), Pad.reset, Pad.close,
+                           port=SERVER_PORT, gyro=False, rumble=True, config_path=CONFIG_PATH)
+
+class ClientSession(sessions.Session):
+    def __init__(self, client_id, conn, addr):
+        super().__init__(client_id, conn, addr)
+        # Last rumble level a pipelined deck was told about
+        self.sent_rumble = slider_rumble
 
-def update_dpad():
-    vertical = None
-    horizontal = None
-
-    if dpad_state['up'] and not dpad_state['down']:
-        vertical = 'up'
-    elif dpad_state['down'] and not dpad_state['up']:
-        vertical = 'down'
-
-    if dpad_state['left'] and not dpad_state['right']:
-        horizontal = 'left'
-    elif dpad_state['right'] and not dpad_state['left']:
-        horizontal = 'right'
-
-    direction = vg.DPAD_DIRECTION.DPAD_OFF
-
-    if vertical == 'up' and horizontal == 'left':
-        direction = vg.DPAD_DIRECTION.DPAD_UP_LEFT
-    elif vertical == 'up' and horizontal == 'right':
-        direction = vg.DPAD_DIRECTION.DPAD_UP_RIGHT
-    elif vertical == 'down' and horizontal == 'left':
-        direction = vg.DPAD_DIRECTION.DPAD_DOWN_LEFT
-    elif vertical == 'down' and horizontal == 'right':
-        direction = vg.DPAD_DIRECTION.DPAD_DOWN_RIGHT
-    elif vertical == 'up':
-        direction = vg.DPAD_DIRECTION.DPAD_UP
-    elif vertical == 'down':
-        direction = vg.DPAD_DIRECTION.DPAD_DOWN
-    elif horizontal == 'left':
-        direction = vg.DPAD_DIRECTION.DPAD_LEFT
-    elif horizontal == 'right':
-        direction = vg.DPAD_DIRECTION.DPAD_RIGHT
-
-    gamepad.dpad(direction)
-    gamepad.update()
-
-def handle_event(code, value):
+def handle_event(pad, code, value, update=True):
     if code.startswith("BTN_"):
         btn = button_map.get(code)
         if btn:
             if value:
-                gamepad.press_button(btn)
-                pressed_buttons.add(btn)
+                pad.buttons |= int(btn)
             else:
-                gamepad.release_button(btn)
-                pressed_buttons.discard(btn)
-            gamepad.update()
+                pad.buttons &= ~int(btn)
+
+    elif code == "HAT_0":
+        x, y = value
+        pad.dpad = ((DPAD_BITS['left'] if x == -1 else DPAD_BITS['right'] if x == 1 else 0) |
+                    (DPAD_BITS['up'] if y == 1 else DPAD_BITS['down'] if y == -1 else 0))
 
     elif code.startswith("HAT_0_"):
-        direction = code.split("_")[-1].lower()
-        if direction in dpad_state:
-            dpad_state[direction] = bool(value)
-        update_dpad()
+        bit = DPAD_BITS.get(code.split("_")[-1].lower())
+        if bit:
+            if value:
+                pad.dpad |= bit
+            else:
+                pad.dpad &= ~bit
 
     elif code.startswith("AXIS_"):
         val = int(value * 32767)
         if code == "AXIS_0":
-            axis_state['LS_x'] = val
+            pad.lx = val
         elif code == "AXIS_1":
-            axis_state['LS_y'] = -val
+            pad.ly = -val
         elif code == "AXIS_3":
-            axis_state['RS_x'] = val
+            pad.rx = val
         elif code == "AXIS_4":
-            axis_state['RS_y'] = -val
+            pad.ry = -val
         elif code == "AXIS_2":
-            axis_state['LT'] = int((value + 1) / 2 * 255)
+            pad.lt = int((value + 1) / 2 * 255)
         elif code == "AXIS_5":
-            axis_state['RT'] = int((value + 1) / 2 * 255)
+            pad.rt = int((value + 1) / 2 * 255)
+
+    if update:
+        pad.commit()
 
-        gamepad.left_joystick(x_value=axis_state['LS_x'], y_value=axis_state['LS_y'])
-        gamepad.right_joystick(x_value=axis_state['RS_x'], y_value=axis_state['RS_y'])
-        gamepad.left_trigger(value=axis_state['LT'])
-        gamepad.right_trigger(value=axis_state['RT'])
-        gamepad.update()
+def apply_batch(pad, data):
+    # Every change from one sender tick goes out as a single report.
+    for code, state in data['events']:
+        handle_event(pad, code, state, update=False)
+    pad.commit()
 
-def apply_full_state(data):
+def apply_full_state(pad, data):
     for i, val in enumerate(data['axes']):
-        handle_event(f"AXIS_{i}", val)
+        handle_event(pad, f"AXIS_{i}", val, update=False)
     for i, val in enumerate(data['buttons']):
-        handle_event(f"BTN_{i}", val)
-    handle_event("HAT_0_LEFT", 0)
-    handle_event("HAT_0_RIGHT", 0)
-    handle_event("HAT_0_UP", 0)
-    handle_event("HAT_0_DOWN", 0)
-    x, y = data['hat']
-    if x == -1:
-        handle_event("HAT_0_LEFT", 1)
-    elif x == 1:
-        handle_event("HAT_0_RIGHT", 1)
-    if y == 1:
-        handle_event("HAT_0_UP", 1)
-    elif y == -1:
-        handle_event("HAT_0_DOWN", 1)
+        handle_event(pad, f"BTN_{i}", val, update=False)
+    handle_event(pad, "HAT_0", data['hat'], update=False)
+    pad.commit()
+
+
+def dispatch_event(pad, event):
+    if event['type'] == 'gamepad':
+        handle_event(pad, event['data']['code'], event['data']['state'])
+    elif event['type'] == 'full_state':
+        apply_full_state(pad, event['data'])
+    elif event['type'] == 'batch':
+        apply_batch(pad, event['data'])
+
+def handle_client(session):
+    # One thread per deck, each with its own virtual pad, so a busy or
+    # stalled deck never holds up the others.
+    conn = session.conn
+    reader = session.reader
+    try:
+        while True:
+            if reader.recv_from(conn) == 0:
+                log.info("⚠️ Client #%d closed the connection.", session.client_id)
+                break
+
+            while True:
+                frame = reader.next_frame()
+                if frame is None:
+                    break
+                if not frame:
+                    continue
+                try:
+                    event = protocol.decode(frame, reader.codec)
+                except Exception as ex:
+                    log.warning("❌ Client #%d %s decode error: %s", session.client_id, reader.codec, ex)
+                    continue
+                if not isinstance(event, dict):
+                    log.warning("❌ Client #%d sent a frame that isn't an object", session.client_id)
+                    continue
+                if event.get('type') == 'hello':
+                    server.negotiate(session, event.get('data', {}), RUMBLE=slider_rumble)
+                    continue
+                if event.get('type') == 'ping':
+                    server.answer_ping(session, event)
+                    continue
+                if session.device is None:
+                    # Older senders send no hello and get a pad with their first frame.
+                    server.open_client(session)
+                applied = True
+                try:
+                    dispatch_event(session.device, event)
+                except Exception as ex:
+                    applied = False
+                    log.error("❌ Client #%d event error: %s", session.client_id, ex)
+                if 'ts' in event:
+                    session.metrics.frame(event['ts'], time.monotonic())
+
+                # Send back rumble status; pipelined decks only hear about changes
+                if session.ack:
+                    server.reply(session, RUMBLE=slider_rumble)
+                    continue
+                server.track_sync(session, event, applied)
+                if session.rumble and slider_rumble != session.sent_rumble:
+                    session.sent_rumble = slider_rumble
+                    session.send({"type": "rumble", "data": {"RUMBLE": slider_rumble}})
+    except Exception as ex:
+        log.error("❌ Socket error in client #%d handler: %s", session.client_id, ex)
+    finally:
+        server.close(session)
 
 def controller_server():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind(("0.0.0.0", SERVER_PORT))
-    sock.listen(1)
-    print("🎮 Waiting for deck...")
+    sock.bind(("0.0.0.0", server.port))
+    sock.listen(10)
+    log.info("🎮 Waiting for decks on port %d...", server.port)
 
     while True:
         try:
             conn, addr = sock.accept()
-            print(f"✅ Connected from {addr}")
-            buffer = ""
-
-            while True:
-                data = conn.recv(1024)
-                if not data:
-                    print("⚠️ Connection closed by client.")
-                    break
+        except Exception as ex:
+            log.error("❌ Socket accept error: %s", ex)
+            continue
+        session = server.accept(conn, addr, ClientSession)
+        threading.Thread(target=handle_client, args=(session,), daemon=True).start()
 
-                buffer += data.decode()
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    try:
-                        event = json.loads(line)
-                        if event['type'] == 'gamepad':
-                            handle_event(event['data']['code'], event['data']['state'])
-                        elif event['type'] == 'full_state':
-                            apply_full_state(event['data'])
-
-                        # Send back rumble status
-                        conn.sendall((json.dumps({"RUMBLE": slider_rumble}) + "\n").encode())
-
-                    except Exception as ex:
-                        print("❌ JSON decode error:", ex)
+def udp_server():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("0.0.0.0", server.port))
+    log.info("📶 UDP input listening on port %d", server.port)
+    while True:
+        try:
+            data, addr = sock.recvfrom(2048)
+        except Exception as ex:
+            log.error("❌ UDP receive error: %s", ex)
+            continue
+        found = server.datagram(data)
+        if found is None:
+            continue
+        session, event = found
+        applied = True
+        try:
+            dispatch_event(session.device, event)
         except Exception as ex:
-            print("❌ Socket error:", ex)
+            applied = False
+            log.error("❌ Client #%d datagram error: %s", session.client_id, ex)
+        if 'ts' in event:
+            session.metrics.frame(event['ts'], time.monotonic())
+        try:
+            server.track_sync(session, event, applied)
+        except OSError as ex:
+            log.error("❌ Error sending to client #%d: %s", session.client_id, ex)
 
-        print("🔄 Waiting for new connection...")
 
-def config_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.bind(("0.0.0.0", CONFIG_PORT))
-        s.listen(1)
-        print("📡 Config server running on port", CONFIG_PORT)
-        while True:
-            conn, addr = s.accept()
-            with conn:
-                config_data = json.dumps({
-                    "USE_UDP": USE_UDP,
-                    "SEND_FULL_STATE": SEND_FULL_STATE,
-                    "RUMBLE": USE_RUMBLE,
-                    "DEBUG": DEBUG
-                })
-                conn.sendall(config_data.encode())
+def stats_loop():
+    while True:
+        time.sleep(SUMMARY_INTERVAL)
+        for key in server.pool.expire():
+            log.info("⌛ Deck %s did not come back, its pad goes back to the pool", key)
+        with server.lock:
+            clients = list(server.clients.values())
+        for session in clients:
+            if session.metrics.latency.count or session.metrics.rtt.count:
+                log.info("⏱️ Client #%d (%s): %s", session.client_id,
+                         "acked" if session.ack else "pipelined", session.metrics.summary())
 
 def run_ui():
     pass  # Placeholder for future tkinter UI on Windows
 
 if __name__ == "__main__":
-    threading.Thread(target=config_server, daemon=True).start()
+    try:
+        server.pool.fill()
+    except Exception as ex:
+        log.error("❌ Could not pre-create virtual pads: %s", ex)
+    threading.Thread(target=server.watch_config, daemon=True).start()
+    threading.Thread(target=server.serve_discovery, daemon=True).start()
     threading.Thread(target=controller_server, daemon=True).start()
+    threading.Thread(target=stats_loop, daemon=True).start()
+    if server.config["USE_UDP"]:
+        threading.Thread(target=udp_server, daemon=True).start()
     if SHOW_UI:
         run_ui()
     else: